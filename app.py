@@ -5,7 +5,9 @@ import folium
 from streamlit_folium import st_folium
 import main
 import config
-import google.generativeai as genai
+import instrumentation
+import botanical_data as bd
+from http_client import get_client
 import os # Import the 'os' library to read environment variables
 
 # --- Page Configuration ---
@@ -15,17 +17,38 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- Cached Resources ---
+# Streamlit reruns this script on every interaction; these are built once per process.
+@st.cache_resource
+def configure_gemini(api_key):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return bd.get_model()
+
+@st.cache_resource
+def warm_http_client():
+    client = get_client()
+    for base_url in (config.SANBI_BASE_URL, config.POWO_BASE_URL):
+        client.session_for(base_url)
+    return client
+
 # --- API Key Configuration (Local Only) ---
 # This code looks ONLY for the local environment variable you set on your PC.
 # It will not crash because it never mentions st.secrets.
 api_key = os.environ.get("GOOGLE_API_KEY")
 
 if api_key:
-    genai.configure(api_key=api_key)
+    configure_gemini(api_key)
+    warm_http_client()
 else:
     st.error("Google API Key not found. Please ensure you have set the GOOGLE_API_KEY environment variable on your local machine.")
     st.stop()
 
+# --- Metrics Endpoint ---
+# Serves Prometheus metrics for all runs of this process; the server starts only once.
+if config.METRICS_PORT:
+    instrumentation.start_metrics_server(config.METRICS_PORT)
+
 # --- App Title and Description ---
 st.title("🌿 Botanical Identification Assistant")
 st.markdown("An AI-powered tool for identifying plants of the Southern African flora.")
@@ -42,13 +65,17 @@ map_col, input_col = st.columns([0.6, 0.4])
 
 with map_col:
     st.subheader("1. Select Location on Map")
-    m = folium.Map(location=st.session_state.center, zoom_start=5)
+    marker = folium.FeatureGroup(name="Selected Location")
     folium.Marker(
         st.session_state.location,
         popup="Selected Location",
         tooltip="Selected Location"
-    ).add_to(m)
-    map_data = st_folium(m, width=700, height=500)
+    ).add_to(marker)
+    # st_folium adds the marker to the map it is given, so the map is built on every run rather
+    # than shared between sessions. Only clicks are returned, so panning and zooming do not rerun.
+    base_map = folium.Map(location=st.session_state.center, zoom_start=5)
+    map_data = st_folium(base_map, key="location_map", width=700, height=500,
+                         feature_group_to_add=marker, returned_objects=["last_clicked"])
     if map_data and map_data["last_clicked"]:
         st.session_state.location = [
             map_data["last_clicked"]["lat"],
@@ -74,26 +101,60 @@ with input_col:
 if submit_button:
     with input_col:
         st.subheader("3. Analysis Results")
-        with st.spinner('Querying GBIF, scraping descriptions, and analyzing with Gemini... Please wait.'):
-            analysis_result, raw_data = main.run_identification_process(
-                latitude=latitude,
-                longitude=longitude,
-                radius_km=radius_km,
-                taxon_name=taxon_name,
-                user_input=user_input
-            )
+        status_text = st.empty()
+        progress_bar = st.progress(0.0)
+        species_table = st.empty()
+        analysis_box = st.empty()
+        status_text.info("Querying GBIF for a species list...")
+
+        rows = []
+        finished = 0
+        analysis_text = ""
+        analysis_result, raw_data, profile = None, None, None
+        for event in main.iter_identification_process(
+            latitude=latitude,
+            longitude=longitude,
+            radius_km=radius_km,
+            taxon_name=taxon_name,
+            user_input=user_input
+        ):
+            if event['type'] == 'checklist':
+                rows = [{"Species": entry['name'], "GBIF records": entry['count'], "Description": "Pending..."}
+                        for entry in event['checklist']]
+                species_table.dataframe(rows, width='stretch', hide_index=True)
+                status_text.info(f"Scraping descriptions for {len(rows)} species...")
+            elif event['type'] == 'species':
+                result = event['result']
+                if result['success']:
+                    rows[event['index']]["Description"] = result.get('source', "Found")
+                else:
+                    rows[event['index']]["Description"] = "Not retrieved in time" if result.get('timed_out') else "Not found"
+                finished += 1
+                progress_bar.progress(finished / len(rows))
+                species_table.dataframe(rows, width='stretch', hide_index=True)
+            elif event['type'] == 'analysis_chunk':
+                if not analysis_text:
+                    status_text.info("Gemini is writing the analysis...")
+                analysis_text += event['text']
+                analysis_box.markdown(analysis_text)
+            elif event['type'] == 'done':
+                analysis_result, raw_data, profile = event['analysis'], event['raw_data'], event['profile']
+
+        progress_bar.empty()
         if analysis_result:
-            st.markdown("---")
-            st.markdown(analysis_result)
-            html_report = main.generate_html_report(analysis_result, raw_data)
-            with open(html_report, "rb") as file:
-                st.download_button(
-                    label="Download Full HTML Report",
-                    data=file,
-                    file_name="taxonomic_analysis.html",
-                    mime="text/html"
-                )
+            status_text.success("Analysis complete.")
+            analysis_box.markdown(analysis_result)
+            # Rendered in memory, so concurrent sessions never share a report file.
+            report = main.render_html_report(analysis_result, raw_data, profile=profile,
+                                             compress=config.REPORT_COMPRESS)
+            st.download_button(
+                label="Download Full HTML Report",
+                data=report,
+                file_name="taxonomic_analysis.html.gz" if config.REPORT_COMPRESS else "taxonomic_analysis.html",
+                mime="application/gzip" if config.REPORT_COMPRESS else "text/html"
+            )
         else:
+            status_text.empty()
             st.error("Analysis could not be completed. Please check the terminal for error messages.")
 
 # --- About and Disclaimer Section ---
@@ -0,0 +1,231 @@
+# batch.py
+
+"""Batch identification of herbarium specimens.
+
+Reads specimens from a CSV or JSONL file with latitude, longitude, radius_km, taxon
+and description fields (plus an optional id). The GBIF checklist is fetched once per
+distinct search area and each species description is fetched once for the whole batch,
+so overlapping specimens share most of their network cost. Analyses then run through
+a pool of BATCH_ANALYSIS_WORKERS Gemini calls.
+
+Output directory:
+  results.jsonl     - one line per finished specimen
+  reports/<id>.html - the per-specimen HTML report
+  checkpoint.jsonl  - every species fetch, successful or not
+
+Rerunning the same command resumes: specimens already in results.jsonl are skipped
+and species fetched successfully in checkpoint.jsonl are not fetched again. Specimens
+whose GBIF checklist or Gemini analysis failed (e.g. on a quota error) and species
+whose fetch failed are retried.
+
+Usage:
+    python batch.py specimens.csv [--out batch_output] [--workers 3]
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import google.generativeai as genai
+
+import botanical_data as bd
+import config
+import main
+
+# Accepted column names (case-insensitive) for each specimen field.
+FIELD_ALIASES = {
+    'id': ('id', 'specimen_id', 'barcode'),
+    'latitude': ('latitude', 'lat', 'decimallatitude'),
+    'longitude': ('longitude', 'lon', 'lng', 'decimallongitude'),
+    'radius_km': ('radius_km', 'radius'),
+    'taxon': ('taxon', 'taxon_name'),
+    'description': ('description', 'user_input', 'notes'),
+}
+RESULTS_FILE = 'results.jsonl'
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+REPORTS_DIR = 'reports'
+
+# --- Input ---
+
+def _field(row, name):
+    for alias in FIELD_ALIASES[name]:
+        value = row.get(alias)
+        if value not in (None, ''):
+            return value
+    return None
+
+def _specimen(row, row_number):
+    row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+    latitude, longitude = _field(row, 'latitude'), _field(row, 'longitude')
+    if latitude is None or longitude is None:
+        raise ValueError(f"Row {row_number} has no latitude/longitude.")
+    radius_km = _field(row, 'radius_km')
+    return {
+        'id': str(_field(row, 'id') or f"row{row_number}").strip(),
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'radius_km': float(radius_km) if radius_km is not None else config.DEFAULT_RADIUS_KM,
+        'taxon': str(_field(row, 'taxon') or config.DEFAULT_TAXON_NAME).strip(),
+        'description': str(_field(row, 'description') or '').strip(),
+    }
+
+def read_specimens(path):
+    """Reads specimen rows from a .jsonl or CSV file."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson')):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    specimens = [_specimen(row, number) for number, row in enumerate(rows, start=1)]
+    seen = set()
+    for specimen in specimens:
+        if specimen['id'] in seen:
+            raise ValueError(f"Duplicate specimen id '{specimen['id']}'.")
+        seen.add(specimen['id'])
+    return specimens
+
+# --- Checkpoints ---
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run; the record is simply redone.
+                continue
+    return records
+
+def _append_jsonl(f, record):
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+
+def _report_path(out_dir, specimen_id):
+    return os.path.join(out_dir, REPORTS_DIR, re.sub(r"[^\w.-]+", "_", specimen_id) + ".html")
+
+# --- Pipeline ---
+
+def _area_key(specimen):
+    return (specimen['latitude'], specimen['longitude'], specimen['radius_km'], specimen['taxon'])
+
+def fetch_checklists(specimens):
+    """Fetches one GBIF checklist per distinct search area.
+
+    Returns {area: [entries]}, where the entries are None for an area whose GBIF query failed.
+    """
+    areas = sorted({_area_key(s) for s in specimens})
+    print(f"Fetching GBIF checklists for {len(areas)} distinct search area(s)...")
+    checklists = {}
+    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+        futures = {executor.submit(bd.fetch_species_checklist, *area): area for area in areas}
+        for future in as_completed(futures):
+            area = futures[future]
+            try:
+                checklists[area] = future.result()
+            except Exception as e:
+                print(f"  GBIF query for {area} failed, will retry on rerun: {e}")
+                checklists[area] = None
+    return checklists
+
+def fetch_descriptions(entries, descriptions, checkpoint_file):
+    """Fetches every checklist entry not already in `descriptions`, recording each in the checkpoint."""
+    by_name = {entry['name']: entry for entry in entries}
+    missing = sorted(by_name.keys() - descriptions.keys())
+    print(f"{len(by_name)} unique species in the batch; {len(missing)} still to fetch.")
+    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+        futures = {executor.submit(main.fetch_species_description, name, by_name[name]): name for name in missing}
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'name': name, 'success': False, 'reason': f"Fetch failed: {e}"}
+            descriptions[name] = result
+            _append_jsonl(checkpoint_file, result)
+            print(f"  [{done}/{len(missing)}] {result['name']}: {result.get('source') if result['success'] else result['reason']}")
+
+def _analyse_specimen(specimen, checklist, descriptions):
+    """Returns the analysis 'done' event (see main.iter_analysis) and the species data."""
+    species_data = [descriptions[entry['name']] for entry in checklist]
+    for event in main.iter_analysis(species_data, specimen['description']):
+        if event['type'] == 'done':
+            return event, species_data
+
+def run_batch(specimens, out_dir, workers=None):
+    """Processes every specimen not already in the results file; returns the number finished.
+
+    Specimens whose GBIF checklist or Gemini analysis fails are left out of the results file,
+    so a rerun retries them.
+    """
+    os.makedirs(os.path.join(out_dir, REPORTS_DIR), exist_ok=True)
+    results_path = os.path.join(out_dir, RESULTS_FILE)
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_FILE)
+
+    finished = {record['id'] for record in _read_jsonl(results_path)}
+    pending = [s for s in specimens if s['id'] not in finished]
+    print(f"{len(specimens)} specimen(s), {len(specimens) - len(pending)} already finished.")
+    if not pending:
+        return 0
+    # Failed fetches may have been transient, so only successful ones are reused.
+    descriptions = {record['name']: record for record in _read_jsonl(checkpoint_path) if record['success']}
+
+    checklists = fetch_checklists(pending)
+    unlisted = [s for s in pending if checklists[_area_key(s)] is None]
+    if unlisted:
+        print(f"{len(unlisted)} specimen(s) have no GBIF checklist and will be retried on rerun.")
+    ready = [s for s in pending if checklists[_area_key(s)] is not None]
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint_file:
+        fetch_descriptions([entry for checklist in checklists.values() if checklist for entry in checklist],
+                           descriptions, checkpoint_file)
+
+    workers = workers or config.BATCH_ANALYSIS_WORKERS
+    print(f"\nAnalysing {len(ready)} specimen(s) with {workers} worker(s)...")
+    failed = len(unlisted)
+    with open(results_path, 'a', encoding='utf-8') as results_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_analyse_specimen, s, checklists[_area_key(s)], descriptions): s for s in ready}
+        for done, future in enumerate(as_completed(futures), start=1):
+            specimen = futures[future]
+            try:
+                event, species_data = future.result()
+            except Exception as e:
+                event, species_data = {'error': str(e)}, None
+            if event['error']:
+                failed += 1
+                print(f"  [{done}/{len(ready)}] {specimen['id']}: analysis failed, will retry on rerun ({event['error']})")
+                continue
+            analysis, report = event['analysis'], None
+            if analysis:
+                report = main.generate_html_report(analysis, event['raw_data'],
+                                                   filename=_report_path(out_dir, specimen['id']))
+            _append_jsonl(results_file, dict(
+                specimen,
+                species_count=len(species_data),
+                described_count=sum(1 for s in species_data if s['success']),
+                analysis=analysis,
+                report=report,
+            ))
+            print(f"  [{done}/{len(ready)}] {specimen['id']}: {'report ' + report if report else 'no analysis'}")
+    return len(pending) - failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('specimens', help="CSV or JSONL file of specimens.")
+    parser.add_argument('--out', default=config.BATCH_OUTPUT_DIR, help="Output (and checkpoint) directory.")
+    parser.add_argument('--workers', type=int, default=config.BATCH_ANALYSIS_WORKERS,
+                        help="Concurrent Gemini analyses.")
+    args = parser.parse_args()
+
+    api_key = os.environ.get('GOOGLE_API_KEY')
+    if not api_key:
+        print("Error: GOOGLE_API_KEY environment variable not set.")
+        exit(1)
+    genai.configure(api_key=api_key)
+
+    processed = run_batch(read_specimens(args.specimens), args.out, args.workers)
+    print(f"\n✅ Batch complete: {processed} specimen(s) finished. Results in '{os.path.join(args.out, RESULTS_FILE)}'.")
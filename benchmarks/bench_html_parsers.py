@@ -0,0 +1,86 @@
+# benchmarks/bench_html_parsers.py
+
+"""Compares the BeautifulSoup and lxml description parsers on HTML fixture pages.
+
+The pages in benchmarks/fixtures are synthetic, not captured pages. Most follow the
+e-Flora SA and POWO markup, padded with filler and with every element explicitly
+closed; the *_nested_blocks and *_unclosed_tags pages hold the markup on which the
+parsers are known to differ (see html_extract.py). Pass captured pages as arguments
+to check those too.
+
+For every fixture this checks that both parsers return exactly the same result and
+reports the median parse time and the peak Python heap allocation of one parse. It
+exits with an error while any fixture differs, so the lxml parsers should not become
+the default (config.HTML_PARSER) until it passes.
+tracemalloc only sees Python allocations, so memory held inside libxml2 during an
+lxml parse is not included.
+
+Usage:
+    python benchmarks/bench_html_parsers.py [--repeat 50] [fixture.html ...]
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import html_extract
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PARSERS = {
+    'powo': (html_extract.parse_powo_description_bs4, html_extract.parse_powo_description_lxml),
+    'eflora': (html_extract.parse_eflorasa_description_bs4, html_extract.parse_eflorasa_description_lxml),
+}
+
+def _median_seconds(parse, html_content, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(html_content)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def _peak_bytes(parse, html_content):
+    tracemalloc.start()
+    try:
+        parse(html_content)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('fixtures', nargs='*', help="HTML files named powo_*.html or eflora_*.html.")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    paths = args.fixtures or sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html')))
+
+    print(f"{'fixture':<34}{'KiB':>6}{'bs4 ms':>9}{'lxml ms':>9}{'speedup':>9}{'bs4 KiB':>10}{'lxml KiB':>10}  same")
+    mismatches = 0
+    for path in paths:
+        kind = os.path.basename(path).split('_', 1)[0]
+        if kind not in PARSERS:
+            print(f"Skipping {path}: name it powo_*.html or eflora_*.html.")
+            continue
+        with open(path, encoding='utf-8') as f:
+            html_content = f.read()
+        old_parse, new_parse = PARSERS[kind]
+        same = old_parse(html_content) == new_parse(html_content)
+        mismatches += not same
+        old_time = _median_seconds(old_parse, html_content, args.repeat)
+        new_time = _median_seconds(new_parse, html_content, args.repeat)
+        print(f"{os.path.basename(path):<34}{len(html_content) / 1024:>6.0f}"
+              f"{old_time * 1000:>9.2f}{new_time * 1000:>9.2f}{old_time / new_time:>8.1f}x"
+              f"{_peak_bytes(old_parse, html_content) / 1024:>10.0f}{_peak_bytes(new_parse, html_content) / 1024:>10.0f}"
+              f"  {'yes' if same else 'NO'}")
+    if mismatches:
+        print(f"\n{mismatches} fixture(s) produced different output.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# benchmarks/bench_pipeline.py
+
+"""End-to-end benchmark of main.run_identification_process without the network.
+
+GBIF, POWO and SANBI are replaced by the local servers in fake_services.py, and
+Gemini by a stub model with a fixed latency. Each checklist size runs in a fresh
+subprocess with an empty cache, so peak RSS and timings are per size and cold.
+Stage times are summed over worker threads; they show where time goes, not wall time.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 10 100 500] [--latency 0.05] [--jitter 0.02]
+        [--error-rate 0.01] [--gemini-latency 0.5] [--json results.json]
+        [--baseline baseline.json] [--tolerance 0.25]
+
+With --baseline the run fails if any size is more than --tolerance slower than the
+wall time recorded in the baseline JSON, which makes it usable as a CI check.
+"""
+
+import argparse
+import contextlib
+import importlib
+import inspect
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+STAGES = {
+    'gbif': 'get_species_checklist_from_gbif',
+    'sanbi_search': 'find_eflorasa_url',
+    'eflora_page': 'scrape_eflorasa_description',
+    'powo_search': 'find_powo_taxon_id',
+    'powo_page': 'scrape_powo_description_from_html',
+    'gemini': 'stream_gemini_analysis',
+    'gemini_mapred': 'stream_gemini_map_reduce',
+}
+USER_INPUT = "Flowers in clusters of 6-10; leaves alternate, shorter than flowers. Flowers red outside, lobes cream inside."
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+    def __iter__(self):
+        # Streaming responses yield chunks that look like the full response.
+        for start in range(0, len(self.text), 200):
+            yield _StubResponse(self.text[start:start + 200])
+
+class StubGenerativeModel:
+    """Stands in for genai.GenerativeModel: waits `latency` seconds and returns a fixed report."""
+    latency = 0.0
+    prompt_chars = []
+
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, **kwargs):
+        StubGenerativeModel.prompt_chars.append(len(prompt))
+        time.sleep(self.latency)
+        headings = ["Analysis of Potential Species", "Most Likely Candidates", "Species Lacking Descriptions",
+                    "Further Steps for Confirmation", "Confidence Level"]
+        return _StubResponse("\n".join(f"### **{heading}**\n- Benchmark placeholder." for heading in headings))
+
+def _stage_timer(func, totals, lock, stage):
+    def record(started):
+        with lock:
+            totals[stage] += time.perf_counter() - started
+
+    def timed_stream(stream, started):
+        try:
+            yield from stream
+        finally:
+            record(started)
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        if inspect.isgenerator(result):
+            # Streaming stages do their work while being iterated.
+            return timed_stream(result, started)
+        record(started)
+        return result
+    return timed
+
+def _peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_one(args):
+    """Runs the pipeline once in this process and returns the measurements."""
+    from fake_services import FakeServices
+
+    services = FakeServices(args.run_one, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, seed=args.seed).start()
+    try:
+        import config
+        config.GBIF_API_URL = f"{services.base_url('gbif')}/v1/"
+        config.POWO_BASE_URL = services.base_url('powo')
+        config.SANBI_BASE_URL = services.base_url('sanbi')
+        config.CACHE_DIR = tempfile.mkdtemp(prefix='flora-bench-cache-')
+        config.USE_LOCAL_OCCURRENCE_INDEX = False
+        config.HTTP_BACKOFF_BASE_SECONDS = 0.05
+        # Large sizes would otherwise be cut off by the run's time budget.
+        config.RUN_TIME_BUDGET_SECONDS = None
+        # Give each fake service the rate limit of the real host it replaces.
+        for service, real_host in (('gbif', 'api.gbif.org'), ('powo', 'powo.science.kew.org'),
+                                   ('sanbi', 'biodiversityadvisor.sanbi.org')):
+            netloc = services.base_url(service).split('://', 1)[1]
+            config.HOST_RATE_LIMITS[netloc] = (
+                config.HOST_RATE_LIMITS[real_host] if args.rate_limits else (1e6, 1e6)
+            )
+
+        import botanical_data as bd
+        import main
+        # botanical_data imports these lazily; load them now so they can be patched.
+        import google.generativeai as genai
+        for module_name in ('pygbif.occurrences', 'pygbif.species'):
+            importlib.import_module(module_name)
+        for module in list(sys.modules.values()):
+            if getattr(module, '__name__', '').startswith('pygbif') and hasattr(module, 'gbif_baseurl'):
+                module.gbif_baseurl = config.GBIF_API_URL
+        StubGenerativeModel.latency = args.gemini_latency
+        genai.GenerativeModel = StubGenerativeModel
+
+        totals = {stage: 0.0 for stage in STAGES}
+        lock = threading.Lock()
+        for stage, function_name in STAGES.items():
+            setattr(bd, function_name, _stage_timer(getattr(bd, function_name), totals, lock, stage))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            analysis, _ = main.run_identification_process(-34.459745, 20.4001533333, 4, "Thymelaeaceae", USER_INPUT)
+            wall = time.perf_counter() - started
+    finally:
+        services.stop()
+
+    requests_made = sum(services.request_counts.values())
+    return {
+        'species': args.run_one,
+        'completed': bool(analysis),
+        'wall_seconds': wall,
+        'species_per_second': args.run_one / wall,
+        'stage_seconds': totals,
+        'requests': dict(services.request_counts),
+        'requests_per_species': requests_made / args.run_one,
+        'prompt_chars': sum(StubGenerativeModel.prompt_chars),
+        'peak_rss_mib': _peak_rss_mib(),
+    }
+
+def _print_table(results):
+    stage_names = list(STAGES)
+    print(f"{'species':>8}{'wall s':>9}{'sp/s':>8}" + ''.join(f"{name:>14}" for name in stage_names)
+          + f"{'req/sp':>8}{'RSS MiB':>9}")
+    for result in results:
+        print(f"{result['species']:>8}{result['wall_seconds']:>9.2f}{result['species_per_second']:>8.1f}"
+              + ''.join(f"{result['stage_seconds'][name]:>14.2f}" for name in stage_names)
+              + f"{result['requests_per_species']:>8.2f}{result['peak_rss_mib']:>9.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against local fake services.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--latency', type=float, default=0.05, help="Base latency per fake request, in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Uniform +/- jitter added to the latency.")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="Share of POWO/SANBI requests answered with 503.")
+    parser.add_argument('--gemini-latency', type=float, default=0.5)
+    parser.add_argument('--no-rate-limits', dest='rate_limits', action='store_false',
+                        help="Lift the per-host rate limits to measure raw throughput.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Write the results to this file.")
+    parser.add_argument('--baseline', help="Results JSON from an earlier run to compare wall times against.")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(args)
+        # Written to a file, since worker threads may still print after the run returns.
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    results = []
+    for size in args.sizes:
+        result_fd, result_path = tempfile.mkstemp(prefix='flora-bench-', suffix='.json')
+        os.close(result_fd)
+        command = [sys.executable, os.path.abspath(__file__), '--run-one', str(size), '--result-file', result_path,
+                   '--latency', str(args.latency), '--jitter', str(args.jitter),
+                   '--error-rate', str(args.error_rate), '--gemini-latency', str(args.gemini_latency),
+                   '--seed', str(args.seed)]
+        if not args.rate_limits:
+            command.append('--no-rate-limits')
+        try:
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=REPO_DIR)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(f"Benchmark run for {size} species failed.")
+            with open(result_path, encoding='utf-8') as f:
+                results.append(json.load(f))
+        finally:
+            os.remove(result_path)
+    _print_table(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {entry['species']: entry for entry in json.load(f)}
+        regressions = [
+            f"{r['species']} species: {r['wall_seconds']:.2f}s vs {baseline[r['species']]['wall_seconds']:.2f}s"
+            for r in results
+            if r['species'] in baseline
+            and r['wall_seconds'] > baseline[r['species']]['wall_seconds'] * (1 + args.tolerance)
+        ]
+        if regressions:
+            print("\nWall-time regressions beyond tolerance:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_startup.py
+
+"""Measures cold import time and Streamlit rerun latency of the app.
+
+Imports are timed in fresh interpreters, so nothing is already loaded. The app is
+driven with Streamlit's AppTest in a separate process: the first run builds the
+cached resources (Gemini configuration, HTTP sessions, base map), and every later
+rerun is what a widget interaction or map click costs. A dummy GOOGLE_API_KEY is
+set; nothing is sent to Gemini.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--reruns 10] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TARGETS = {
+    'main': "import main",
+    'botanical_data': "import botanical_data",
+    'app imports': "import streamlit, folium, streamlit_folium, main",
+}
+
+def _time_import(statement):
+    code = f"import time; started = time.perf_counter(); {statement}; print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def run_app(reruns):
+    """Runs app.py under AppTest in this process and returns the timings."""
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    app = AppTest.from_file(os.path.join(REPO_DIR, 'app.py'), default_timeout=120).run()
+    first_run = time.perf_counter() - started
+    if app.exception:
+        raise RuntimeError(f"app.py raised: {app.exception[0].value}")
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        timings.append(time.perf_counter() - started)
+    return {'first_run_seconds': first_run, 'rerun_seconds': timings}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per import measurement.")
+    parser.add_argument('--reruns', type=int, default=10, help="App reruns after the first run.")
+    parser.add_argument('--json', help="Also write the results to this file.")
+    parser.add_argument('--run-app', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_app:
+        print(json.dumps(run_app(args.reruns)))
+        return
+
+    results = {'imports': {}}
+    print(f"{'cold import':<20}{'median s':>10}{'min s':>10}")
+    for label, statement in IMPORT_TARGETS.items():
+        timings = [_time_import(statement) for _ in range(args.repeat)]
+        results['imports'][label] = {'median_seconds': statistics.median(timings), 'min_seconds': min(timings)}
+        print(f"{label:<20}{statistics.median(timings):>10.3f}{min(timings):>10.3f}")
+
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-app', '--reruns', str(args.reruns)],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    app = json.loads(output.stdout.strip().splitlines()[-1])
+    results['app'] = app
+    print(f"\napp first run        {app['first_run_seconds']:.3f} s")
+    if app['rerun_seconds']:
+        print(f"app rerun (median)   {statistics.median(app['rerun_seconds']) * 1000:.1f} ms over {len(app['rerun_seconds'])} reruns")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# benchmarks/fake_services.py
+
+"""Local stand-ins for the GBIF, POWO and SANBI endpoints used by botanical_data.
+
+Each service runs on its own port so the per-host rate limiters behave as they do
+against the real hosts. Responses are replayed from the saved pages in
+benchmarks/fixtures, with the species name substituted. Every request is delayed by
+latency +/- jitter, and POWO/SANBI requests can be answered with a 503 at random
+(error injection) to exercise the client's retries.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+POWO_TEMPLATE_NAME = 'Gnidia squarrosa'
+EFLORA_TEMPLATE_NAME = 'Gnidia squarrosa'
+GBIF_TAXON_KEY = 7374
+FIRST_SPECIES_KEY = 9000000
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+class FakeServices:
+    """Starts the three fake services for a synthetic checklist of `species_count` species.
+
+    `eflora_fraction` of the species have an e-Flora SA page; the rest fall through to POWO.
+    """
+    def __init__(self, species_count, latency=0.0, jitter=0.0, error_rate=0.0, eflora_fraction=0.7, seed=0,
+                 error_services=('powo', 'sanbi')):
+        self.species = [f"Gnidia benchspecies{i:04d}" for i in range(species_count)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_services = set(error_services)
+        self.eflora_fraction = eflora_fraction
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+        self._powo_page = _load_fixture('powo_gnidia_squarrosa.html')
+        self._eflora_page = _load_fixture('eflora_gnidia_squarrosa.html')
+        self._servers = {}
+
+    # --- lifecycle ---
+
+    def start(self):
+        for service, handler in (('gbif', self._gbif), ('powo', self._powo), ('sanbi', self._sanbi)):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class(service, handler))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers[service] = server
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def base_url(self, service):
+        return f"http://127.0.0.1:{self._servers[service].server_port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # --- request handling ---
+
+    def _handler_class(self, service, route):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                services._count(service)
+                delay, fail = services._draw()
+                time.sleep(delay)
+                if fail and service in services.error_services:
+                    self._send(503, 'text/plain', b'injected failure', {'Retry-After': '0'})
+                    return
+                status, content_type, body = route(parsed.path, query)
+                self._send(status, content_type, body.encode('utf-8'))
+
+            def _send(self, status, content_type, body, extra_headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (extra_headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def _count(self, service):
+        with self._counts_lock:
+            self.request_counts[service] = self.request_counts.get(service, 0) + 1
+
+    def _draw(self):
+        with self._random_lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            return delay, self._random.random() < self.error_rate
+
+    def _has_eflora(self, index):
+        return index < round(len(self.species) * self.eflora_fraction)
+
+    def _species_index(self, name):
+        match = re.search(r'benchspecies(\d+)', name or '')
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _json(payload):
+        return 200, 'application/json', json.dumps(payload)
+
+    def _gbif(self, path, query):
+        if path.endswith('/species/match'):
+            return self._json({'usageKey': GBIF_TAXON_KEY, 'rank': 'FAMILY', 'scientificName': query.get('name')})
+        if path.endswith('/occurrence/search'):
+            if query.get('facet'):
+                counts = [{'name': str(FIRST_SPECIES_KEY + i), 'count': len(self.species) - i}
+                          for i in range(len(self.species))]
+                return self._json({'offset': 0, 'limit': 0, 'endOfRecords': True, 'count': sum(c['count'] for c in counts),
+                                   'results': [], 'facets': [{'field': 'SPECIES_KEY', 'counts': counts}]})
+            return self._gbif_occurrence_page(query)
+        match = re.search(r'/species/(\d+)$', path)
+        if match:
+            index = int(match.group(1)) - FIRST_SPECIES_KEY
+            if 0 <= index < len(self.species):
+                return self._json({'key': int(match.group(1)), 'species': self.species[index], 'rank': 'SPECIES'})
+        return 404, 'application/json', '{}'
+
+    def _gbif_occurrence_page(self, query):
+        lat_range = [float(v) for v in query['decimalLatitude'].split(',')]
+        lon_range = [float(v) for v in query['decimalLongitude'].split(',')]
+        latitude, longitude = sum(lat_range) / 2, sum(lon_range) / 2
+        offset, limit = int(query.get('offset', 0)), int(query.get('limit', 300))
+        records = [
+            {'species': name, 'speciesKey': FIRST_SPECIES_KEY + i,
+             'decimalLatitude': latitude + 0.001 * (i % 7), 'decimalLongitude': longitude - 0.001 * (i % 5)}
+            for i, name in enumerate(self.species)
+        ]
+        page = records[offset:offset + limit]
+        return self._json({'offset': offset, 'limit': limit, 'count': len(records),
+                           'endOfRecords': offset + limit >= len(records), 'results': page})
+
+    def _powo(self, path, query):
+        if path.endswith('/api/2/search'):
+            index = self._species_index(query.get('q'))
+            if index is None:
+                return self._json({'results': []})
+            return self._json({'results': [{'fqId': f'urn:lsid:ipni.org:names:{index}-1', 'name': query['q']}]})
+        match = re.search(r'/taxon/urn:lsid:ipni\.org:names:(\d+)-1/general-information$', unquote(path))
+        if match and int(match.group(1)) < len(self.species):
+            return 200, 'text/html; charset=utf-8', self._powo_page.replace(POWO_TEMPLATE_NAME, self.species[int(match.group(1))])
+        return 404, 'text/html', '<html><body>Not found</body></html>'
+
+    def _sanbi(self, path, query):
+        if path.endswith('/search/ServersideSearch'):
+            index = self._species_index(query.get('q'))
+            if index is None or not self._has_eflora(index):
+                return self._json({'data': []})
+            return self._json({'data': [{'_source': {'italicspeciesname': query['q'], 'synonyms': '', 'speciesid': index}}]})
+        match = re.search(r'/search/detail/(\d+)$', path)
+        if match and self._has_eflora(int(match.group(1))):
+            return 200, 'text/html; charset=utf-8', self._eflora_page.replace(EFLORA_TEMPLATE_NAME, self.species[int(match.group(1))])
+        return 404, 'text/html', '<html><body>Not found</body></html>'
@@ -1,81 +1,362 @@
 # botanical_data.py
 
 import requests
-from bs4 import BeautifulSoup
 import re
-import google.generativeai as genai
-import time
-import pygbif.species as gbif_species
-import pygbif.occurrences as gbif_occ
 import math
-from functools import wraps
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+import numpy as np
 
 # Import constants from your config file
-from config import HEADERS, MODEL_NAME
+from config import (
+    HEADERS, MODEL_NAME, MAX_WORKERS, GBIF_API_URL, POWO_BASE_URL, SANBI_BASE_URL,
+    GBIF_LISTING_MODE, GBIF_FACET_LIMIT, GBIF_PAGE_SIZE, GBIF_MAX_RECORDS,
+    USE_LOCAL_OCCURRENCE_INDEX, GBIF_NETWORK_FALLBACK,
+    GEMINI_CHUNK_TOKENS, GEMINI_MAP_WORKERS, GEMINI_CHUNK_RETRIES, GEMINI_SHORTLIST_SIZE, PROMPT_TOKEN_BUDGET,
+    GEMINI_CHUNK_BACKOFF_BASE_SECONDS, GEMINI_CHUNK_BACKOFF_MAX_SECONDS,
+)
+from rate_limit import throttle
+from http_client import get_client, backoff_delay
+from html_extract import parse_powo_description, parse_eflorasa_description
+from cache import cached, normalise_name
+import occurrence_index
+import name_index
+import checklist_tiles
+from ranking import estimate_tokens, select_descriptions
+from instrumentation import instrumented, annotate, record, bind, span
+from singleflight import singleflight
+
+# The Gemini and GBIF client libraries take about a second to import (pygbif pulls in
+# matplotlib), so they are loaded on first use rather than with this module.
+def _genai():
+    import google.generativeai as genai
+    return genai
+
+def _gbif_species():
+    import pygbif.species as gbif_species
+    return gbif_species
+
+def _gbif_occ():
+    import pygbif.occurrences as gbif_occ
+    return gbif_occ
+
+@lru_cache(maxsize=None)
+def get_model(model_name=MODEL_NAME):
+    """Returns the shared Gemini model object for `model_name`."""
+    return _genai().GenerativeModel(model_name)
+
+def network_guard(failure=None):
+    """Decorator returning `failure` when a request still fails after the HTTP client's retries.
 
-# (All other functions like retry_request, get_species_list_from_gbif, etc., remain exactly the same)
-# ...
-def retry_request(max_attempts=3, delay=2):
-    """Decorator to retry a function if a requests.RequestException occurs."""
+    It goes above `cached`, so that an outage is retried on the next call instead of
+    being cached as a negative result.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            for attempt in range(max_attempts):
-                try:
-                    return func(*args, **kwargs)
-                except requests.exceptions.RequestException as e:
-                    print(f"--> Network attempt {attempt + 1} for '{func.__name__}' failed: {e}")
-                    if attempt < max_attempts - 1:
-                        print(f"--> Retrying in {delay} seconds...")
-                        time.sleep(delay)
-                    else:
-                        print(f"--> All network attempts failed for '{func.__name__}'.")
-                        return None
+            try:
+                return func(*args, **kwargs)
+            except requests.exceptions.RequestException as e:
+                print(f"--> All network attempts failed for '{func.__name__}': {e}")
+                return failure
         return wrapper
     return decorator
 
-def get_species_list_from_gbif(latitude, longitude, radius_km, taxon_name):
-    """Queries GBIF for a list of species within a given radius of a coordinate."""
+def _url_key(url):
+    return url
+
+def _is_missing(result):
+    return result is None
+
+def _is_failed_scrape(result):
+    return not result[0]
+
+def _taxon_key(taxon_name):
+    return taxon_name.strip().lower()
+
+def _checklist_key(latitude, longitude, radius_km, taxon_name, mode=None):
+    return (round(float(latitude), 6), round(float(longitude), 6), float(radius_km), _taxon_key(taxon_name),
+            mode or GBIF_LISTING_MODE)
+
+EARTH_RADIUS_KM = 6371.0088
+
+def _haversine_km(latitude, longitude, lats, lons):
+    """Vectorised great-circle distance in km from one point to arrays of points."""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+@instrumented('gbif_taxon_key')
+@singleflight('gbif-taxon-key', _taxon_key)
+@cached('gbif-taxon-key', _taxon_key, _is_missing)
+def _lookup_gbif_taxon_key(taxon_name):
+    """Resolves a taxon name to a GBIF backbone usageKey, or None if GBIF has no match.
+
+    Request errors propagate, so that an outage is not cached as a missing taxon.
+    """
+    throttle(GBIF_API_URL)
+    taxon_info = _gbif_species().name_backbone(name=taxon_name)
+    if 'usageKey' not in taxon_info:
+        print(f"--> Could not find a taxon key for '{taxon_name}' on GBIF.")
+        return None
+    if 'rank' in taxon_info: print(f"--> GBIF identified '{taxon_name}' as a {taxon_info['rank'].lower()}.")
+    taxon_key = taxon_info['usageKey']
+    print(f"--> Found GBIF taxonKey for '{taxon_name}': {taxon_key}")
+    return taxon_key
+
+@instrumented('gbif_species_name')
+@singleflight('gbif-species-name', str)
+@cached('gbif-species-name', str, _is_missing)
+def _gbif_species_name(species_key):
+    """Looks up the binomial for a GBIF speciesKey; request errors propagate uncached."""
+    throttle(GBIF_API_URL)
+    usage = _gbif_species().name_usage(key=species_key)
+    return usage.get('species') or usage.get('canonicalName')
+
+def _species_counts_from_facets(taxon_key, latitude, longitude, radius_km):
+    """Counts records per speciesKey with a single faceted search restricted to the exact radius."""
+    return _facet_species_counts(taxon_key, geoDistance=f"{latitude},{longitude},{radius_km}km")
+
+@instrumented('gbif_facets')
+def _facet_species_counts(taxon_key, **area):
+    """Counts records per speciesKey in one faceted search over `area` (GBIF occurrence search filters)."""
+    throttle(GBIF_API_URL)
+    result = _gbif_occ().search(
+        taxonKey=taxon_key, **area,
+        hasCoordinate=True, hasGeospatialIssue=False, limit=0,
+        facet='speciesKey', facetMincount=1, speciesKey_facetLimit=GBIF_FACET_LIMIT
+    )
+    counts = {}
+    for facet in result.get('facets', []):
+        if facet.get('field') == 'SPECIES_KEY':
+            for entry in facet.get('counts', []):
+                counts[int(entry['name'])] = entry['count']
+    if len(counts) >= GBIF_FACET_LIMIT:
+        print(f"--> Warning: GBIF facet limit of {GBIF_FACET_LIMIT} species reached; the list may be incomplete.")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        names = dict(zip(counts, executor.map(bind(_gbif_species_name), counts)))
+    return {key: (names[key], count) for key, count in counts.items() if names[key]}
+
+@instrumented('gbif_occurrences')
+def _fetch_occurrence_records(taxon_key, min_lat, max_lat, min_lon, max_lon, allow_partial=True):
+    """Pages through occurrences in a bounding box.
+
+    Returns ([(lat, lon, species_key, name)], complete), where `complete` is False if
+    paging stopped at GBIF_MAX_RECORDS. Without `allow_partial`, a box holding more than
+    GBIF_MAX_RECORDS records returns ([], False) after the first page instead.
+    """
+    records = []
+    offset = 0
+    while True:
+        throttle(GBIF_API_URL)
+        page = _gbif_occ().search(
+            taxonKey=taxon_key, decimalLatitude=f'{min_lat},{max_lat}', decimalLongitude=f'{min_lon},{max_lon}',
+            hasCoordinate=True, hasGeospatialIssue=False, limit=GBIF_PAGE_SIZE, offset=offset
+        )
+        results = page.get('results', [])
+        if not allow_partial and page.get('count', 0) > GBIF_MAX_RECORDS:
+            annotate(records=0, pages=1, over_limit=True)
+            return [], False
+        for occurrence in results:
+            if 'species' in occurrence and 'speciesKey' in occurrence:
+                records.append((occurrence['decimalLatitude'], occurrence['decimalLongitude'],
+                                occurrence['speciesKey'], occurrence['species']))
+        offset += len(results)
+        annotate(records=len(records), pages=offset // GBIF_PAGE_SIZE + 1)
+        if page.get('endOfRecords', True) or not results:
+            return records, True
+        if offset >= GBIF_MAX_RECORDS:
+            print(f"--> Warning: stopped after {offset} of {page.get('count', '?')} GBIF records (GBIF_MAX_RECORDS).")
+            return records, False
+
+def _count_species_within(latitude, longitude, radius_km, lats, lons, keys, names):
+    """Counts records per speciesKey among those inside the exact radius."""
+    if not keys:
+        return {}
+    inside = _haversine_km(latitude, longitude, np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)) <= radius_km
+    unique_keys, counts = np.unique(np.asarray(keys, dtype=np.int64)[inside], return_counts=True)
+    return {int(key): (names[int(key)], int(count)) for key, count in zip(unique_keys, counts)}
+
+def _species_counts_from_occurrences(taxon_key, latitude, longitude, radius_km):
+    """Pages through occurrences in the bounding box and keeps only those inside the exact radius."""
+    lat_offset = radius_km / 111.32
+    lon_offset = radius_km / (111.32 * abs(math.cos(math.radians(latitude))))
+    records, _ = _fetch_occurrence_records(
+        taxon_key, latitude - lat_offset, latitude + lat_offset, longitude - lon_offset, longitude + lon_offset
+    )
+    lats, lons, keys, names = [], [], [], {}
+    for record_lat, record_lon, species_key, name in records:
+        lats.append(record_lat)
+        lons.append(record_lon)
+        keys.append(species_key)
+        names[species_key] = name
+    return _count_species_within(latitude, longitude, radius_km, lats, lons, keys, names)
+
+@singleflight('gbif-tile-block', lambda taxon_key, block: (taxon_key, tuple(block)))
+def _fetch_tile_block(taxon_key, block):
+    """Fetches and caches the tiles of a block; returns (tiles, complete)."""
+    records, complete = _fetch_occurrence_records(taxon_key, *checklist_tiles.block_bounds(block), allow_partial=False)
+    if not complete:
+        return {}, False
+    tiles = checklist_tiles.split_records(block, records)
+    checklist_tiles.store_tiles(taxon_key, tiles)
+    return tiles, True
+
+@instrumented('gbif_tiles')
+def _species_counts_from_tiles(taxon_key, latitude, longitude, radius_km):
+    """Like the occurrences mode, but reuses cached geohash tiles and fetches only the missing ones.
+
+    Areas holding more than GBIF_MAX_RECORDS uncached records cannot be tiled completely, so
+    they are answered with the faceted count query instead.
+    """
+    cells = checklist_tiles.covering_cells(latitude, longitude, radius_km)
+    tiles = checklist_tiles.load_tiles(taxon_key, cells)
+    missing = [cell for cell in cells if cell not in tiles]
+    blocks = checklist_tiles.plan_fetches(missing)
+    annotate(cells=len(cells), cached_cells=len(tiles), queries=len(blocks))
+    print(f"--> {len(tiles)} of {len(cells)} grid cells cached; fetching {len(missing)} in {len(blocks)} GBIF quer{'y' if len(blocks) == 1 else 'ies'}.")
+    complete = True
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for fetched, block_complete in executor.map(bind(lambda block: _fetch_tile_block(taxon_key, block)), blocks):
+            tiles.update(fetched)
+            complete = complete and block_complete
+    if not complete:
+        print(f"--> Too many GBIF records to tile this area (over {GBIF_MAX_RECORDS}); using a faceted count instead.")
+        annotate(facet_fallback=True)
+        return _species_counts_from_facets(taxon_key, latitude, longitude, radius_km)
+
+    lats, lons, keys, names = [], [], [], {}
+    for tile in tiles.values():
+        lats.extend(tile['lats'])
+        lons.extend(tile['lons'])
+        keys.extend(tile['keys'])
+        names.update((int(key), name) for key, name in tile['names'].items())
+    return _count_species_within(latitude, longitude, radius_km, lats, lons, keys, names)
+
+@instrumented('occurrence_index')
+def _checklist_from_local_index(latitude, longitude, radius_km, taxon_name):
+    """Answers a checklist query from the local occurrence index, or returns None if it cannot."""
+    index = occurrence_index.load_index()
+    if index is None:
+        return None
+    if not index.covers(latitude, longitude, radius_km, taxon_name):
+        print(f"--> No export in the local occurrence index covers '{taxon_name}' in this area.")
+        return None
+    checklist = index.query_checklist(latitude, longitude, radius_km, taxon_name)
+    if checklist is None:
+        print(f"--> '{taxon_name}' does not occur in the local occurrence index.")
+        return None
+    print(f"--> Found {len(checklist)} unique species in the local occurrence index.")
+    return _merge_by_accepted_name(checklist)
+
+def _merge_by_accepted_name(checklist):
+    """Resolves every checklist name in one name index lookup and merges entries of one accepted species.
+
+    Merged or renamed entries carry the names GBIF listed them under in 'synonyms'. Resolved
+    entries also carry the 'sanbi_id' and 'powo_id' the index knows (None where it does not),
+    which let main.fetch_species_description skip the SANBI and POWO searches.
+    """
+    resolved = name_index.resolve_names([entry['name'] for entry in checklist])
+    if not any(resolved):
+        return checklist
+    merged = {}
+    for entry, taxon in zip(checklist, resolved):
+        name = taxon['name'] if taxon else entry['name']
+        existing = merged.get(normalise_name(name))
+        if existing is None:
+            existing = merged[normalise_name(name)] = {
+                'name': name, 'species_key': (taxon and taxon['gbif_key']) or entry['species_key'], 'count': 0,
+            }
+            if taxon:
+                existing.update(sanbi_id=taxon['sanbi_id'], powo_id=taxon['powo_id'])
+        existing['count'] += entry['count']
+        if entry['name'] != name:
+            existing.setdefault('synonyms', []).append(entry['name'])
+    checklist = sorted(merged.values(), key=lambda entry: (-entry['count'], entry['name']))
+    renamed = sum(len(entry.get('synonyms', [])) for entry in checklist)
+    if renamed:
+        print(f"--> Resolved {renamed} GBIF names to accepted names; {len(checklist)} species remain.")
+    return checklist
+
+@instrumented('checklist')
+@singleflight('gbif-checklist', _checklist_key)
+def fetch_species_checklist(latitude, longitude, radius_km, taxon_name, mode=None):
+    """Returns species recorded within radius_km of a coordinate, ranked by number of GBIF records.
+
+    Each entry is a dict with 'name', 'species_key' and 'count'; names are accepted names and
+    SANBI/POWO IDs are added where the local name index knows them (see _merge_by_accepted_name). The local occurrence index is
+    used when it covers the query; otherwise GBIF is queried and `mode` is 'facet' for a
+    single faceted count query, 'occurrences' to page through the records themselves or
+    'tiles' to do the same through the geohash tile cache; it defaults to GBIF_LISTING_MODE.
+    Raises if the GBIF query fails, so that callers can tell a failure from an empty area.
+    """
+    mode = mode or GBIF_LISTING_MODE
     print(f"Querying GBIF for '{taxon_name}' species within {radius_km}km of ({latitude}, {longitude})...")
-    try:
-        taxon_info = gbif_species.name_backbone(name=taxon_name)
-        if 'usageKey' not in taxon_info:
-            print(f"--> Could not find a taxon key for '{taxon_name}' on GBIF.")
+    if USE_LOCAL_OCCURRENCE_INDEX:
+        checklist = _checklist_from_local_index(latitude, longitude, radius_km, taxon_name)
+        if checklist is not None:
+            return checklist
+        if not GBIF_NETWORK_FALLBACK:
+            print("--> The network GBIF fallback is disabled.")
             return []
-        if 'rank' in taxon_info: print(f"--> GBIF identified '{taxon_name}' as a {taxon_info['rank'].lower()}.")
-        taxon_key = taxon_info['usageKey']
-        print(f"--> Found GBIF taxonKey for '{taxon_name}': {taxon_key}")
-    except Exception as e:
-        print(f"--> Error looking up taxon key on GBIF: {e}")
+    taxon_key = _lookup_gbif_taxon_key(taxon_name)
+    if taxon_key is None:
         return []
+    if mode == 'facet':
+        species_counts = _species_counts_from_facets(taxon_key, latitude, longitude, radius_km)
+    elif mode == 'tiles':
+        species_counts = _species_counts_from_tiles(taxon_key, latitude, longitude, radius_km)
+    else:
+        species_counts = _species_counts_from_occurrences(taxon_key, latitude, longitude, radius_km)
 
-    lat_offset = radius_km / 111.32
-    lon_offset = radius_km / (111.32 * abs(math.cos(math.radians(latitude))))
-    min_lat, max_lat = latitude - lat_offset, latitude + lat_offset
-    min_lon, max_lon = longitude - lon_offset, longitude + lon_offset
+    checklist = [{'name': name, 'species_key': key, 'count': count} for key, (name, count) in species_counts.items()]
+    checklist.sort(key=lambda entry: (-entry['count'], entry['name']))
+    print(f"--> Found {len(checklist)} unique species on GBIF.")
+    return _merge_by_accepted_name(checklist)
 
+def get_species_checklist_from_gbif(latitude, longitude, radius_km, taxon_name, mode=None):
+    """As fetch_species_checklist, but returns an empty list when the GBIF query fails."""
     try:
-        occurrences = gbif_occ.search(
-            taxonKey=taxon_key, decimalLatitude=f'{min_lat},{max_lat}', decimalLongitude=f'{min_lon},{max_lon}',
-            hasCoordinate=True, hasGeospatialIssue=False, limit=1000
+        return fetch_species_checklist(latitude, longitude, radius_km, taxon_name, mode)
+    except Exception as e:
+        print(f"--> An error occurred while querying GBIF: {e}")
+        return []
+
+def get_species_checklist_in_bbox(min_lat, max_lat, min_lon, max_lon, taxon_name):
+    """Returns species recorded inside a bounding box, in the same form as get_species_checklist_from_gbif."""
+    print(f"Querying GBIF for '{taxon_name}' species in lat {min_lat}..{max_lat}, lon {min_lon}..{max_lon}...")
+    try:
+        taxon_key = _lookup_gbif_taxon_key(taxon_name)
+        if taxon_key is None:
+            return []
+        species_counts = _facet_species_counts(
+            taxon_key, decimalLatitude=f'{min_lat},{max_lat}', decimalLongitude=f'{min_lon},{max_lon}'
         )
-        species_set = set(record['species'] for record in occurrences['results'] if 'species' in record)
-        species_list = sorted(list(species_set))
-        print(f"--> Found {len(species_list)} unique species on GBIF.")
-        return species_list
     except Exception as e:
-        print(f"--> An error occurred during the GBIF occurrence search: {e}")
+        print(f"--> An error occurred while querying GBIF: {e}")
         return []
+    checklist = [{'name': name, 'species_key': key, 'count': count} for key, (name, count) in species_counts.items()]
+    checklist.sort(key=lambda entry: (-entry['count'], entry['name']))
+    print(f"--> Found {len(checklist)} unique species on GBIF.")
+    return _merge_by_accepted_name(checklist)
 
-@retry_request()
+def get_species_list_from_gbif(latitude, longitude, radius_km, taxon_name):
+    """Queries GBIF for a sorted list of species names within a given radius of a coordinate."""
+    checklist = get_species_checklist_from_gbif(latitude, longitude, radius_km, taxon_name)
+    return sorted({entry['name'] for entry in checklist})
+
+@instrumented('powo_search')
+@network_guard()
+@singleflight('powo-id', normalise_name)
+@cached('powo-id', normalise_name, _is_missing)
 def find_powo_taxon_id(scientific_name):
     """Finds the POWO taxon ID for a given scientific name."""
-    search_url = "https://powo.science.kew.org/api/2/search"
+    search_url = f"{POWO_BASE_URL}/api/2/search"
     params = {'q': scientific_name}
-    headers = {'User-Agent': HEADERS['User-Agent'], 'Referer': 'https://powo.science.kew.org/'}
-    response = requests.get(search_url, params=params, headers=headers, timeout=30)
-    response.raise_for_status()
-    data = response.json()
+    headers = {'User-Agent': HEADERS['User-Agent'], 'Referer': f'{POWO_BASE_URL}/'}
+    data = get_client().get_json(search_url, params=params, headers=headers)
     if data and data.get('results'):
         first_result = data['results'][0]
         taxon_id = first_result.get('fqId')
@@ -86,56 +367,28 @@ def find_powo_taxon_id(scientific_name):
         print(f"--> No POWO results found for '{scientific_name}'")
         return None
 
+@instrumented('powo_page')
+@network_guard((False, "Failed to fetch POWO page after multiple attempts."))
+@singleflight('powo-description', _url_key)
+@cached('powo-description', _url_key, _is_failed_scrape)
 def scrape_powo_description_from_html(url):
     """Scrapes the morphological description from a POWO general information page."""
-    @retry_request()
-    def _fetch_html(target_url):
-        headers = {'User-Agent': HEADERS['User-Agent'], 'Referer': 'https://powo.science.kew.org/'}
-        response = requests.get(target_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.text
-
-    html_content = _fetch_html(url)
-    if not html_content: return (False, "Failed to fetch POWO page after multiple attempts.")
-
-    soup = BeautifulSoup(html_content, 'html.parser')
-    descriptions_section = soup.find('section', id='descriptions')
-    if not descriptions_section: return (False, "No description section found on POWO page.")
-
-    all_descriptions_text = []
-    has_morphological_data = False
-    morphological_keywords = ['morphology', 'habit', 'leaves', 'stem', 'flowers', 'fruit', 'inflorescence', 'bracts', 'perianth', 'style', 'ecology', 'note', 'type']
-    description_blocks = descriptions_section.find_all('div', class_='description')
-    if not description_blocks: return (False, "Description section exists but contains no description blocks.")
-
-    for block in description_blocks:
-        source_text = "Unknown Source"
-        source_button = block.find('button', class_='collapser')
-        if source_button and source_button.find('span', class_='text'):
-            source_text = source_button.find('span', class_='text').get_text(strip=True)
-        all_descriptions_text.append(f"--- {source_text} ---\n")
-        dl = block.find('dl', class_='c-article-desc-table')
-        if dl:
-            for dt, dd in zip(dl.find_all('dt'), dl.find_all('dd')):
-                term = ' '.join(span.get_text(strip=True) for span in dt.find_all('span'))
-                if any(keyword in term.lower() for keyword in morphological_keywords): has_morphological_data = True
-                definition = dd.get_text(strip=True)
-                formatted_definition = re.sub(r"([a-z])([A-Z])", r"\1\n\2", definition)
-                all_descriptions_text.append(f"{term}:\n{formatted_definition}\n")
-
-    if not has_morphological_data:
-        print("--> POWO page found, but it contains no useful morphological data.")
-        return (False, "No morphological description found on POWO.")
-    return (True, "\n".join(all_descriptions_text))
-
-@retry_request()
+    headers = {'User-Agent': HEADERS['User-Agent'], 'Referer': f'{POWO_BASE_URL}/'}
+    html_content = get_client().get_text(url, headers=headers)
+    if not html_content: return (False, "POWO returned an empty page.")
+
+    with span('parse_powo'):
+        return parse_powo_description(html_content)
+
+@instrumented('sanbi_search')
+@network_guard()
+@singleflight('eflora-url', normalise_name)
+@cached('eflora-url', normalise_name, _is_missing)
 def find_eflorasa_url(scientific_name):
     """Searches SANBI's internal API to find the e-Flora SA URL for a species."""
-    search_url = "https://biodiversityadvisor.sanbi.org/search/ServersideSearch"
+    search_url = f"{SANBI_BASE_URL}/search/ServersideSearch"
     params = {'q': scientific_name, 'index': 'bodatsa', 'filter': 'synonyms', 'sortBy': '_score', 'sortOrder': 'asc'}
-    response = requests.get(search_url, params=params, headers=HEADERS, timeout=30)
-    response.raise_for_status()
-    data = response.json()
+    data = get_client().get_json(search_url, params=params)
     if data and data.get('data') and len(data['data']) > 0:
         first_result = data['data'][0]
         source = first_result.get('_source', {})
@@ -144,59 +397,47 @@ def find_eflorasa_url(scientific_name):
         if scientific_name.lower() in full_name.lower() or scientific_name.lower() in synonyms.lower():
             species_id = source.get('speciesid')
             if species_id:
-                found_url = f"https://biodiversityadvisor.sanbi.org/search/detail/{species_id}"
+                found_url = f"{SANBI_BASE_URL}/search/detail/{species_id}"
                 print(f"--> Found e-Flora SA match (via API): {found_url}")
                 return found_url
     print(f"--> No e-Flora SA match found for '{scientific_name}'")
     return None
 
+@instrumented('eflora_page')
+@network_guard((False, "Failed to fetch e-Flora SA page after multiple attempts."))
+@singleflight('eflora-description', _url_key)
+@cached('eflora-description', _url_key, _is_failed_scrape)
 def scrape_eflorasa_description(url):
     """Scrapes description sections from a given e-Flora of South Africa URL."""
-    @retry_request()
-    def _fetch_html(target_url):
-        response = requests.get(target_url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        return response.text
-
-    html_content = _fetch_html(url)
+    html_content = get_client().get_text(url)
     if not html_content:
-        return (False, "Failed to fetch e-Flora SA page after multiple attempts.")
-
-    soup = BeautifulSoup(html_content, 'html.parser')
-    all_blocks = soup.find_all('div', class_='details-bordered')
-    extracted_data = []
+        return (False, "e-Flora SA returned an empty page.")
 
-    for block in all_blocks:
-        heading_tag = block.find('div', class_='details-bordered-heading')
-        body_tag = block.find('div', class_='details-bordered-body')
-
-        if heading_tag and body_tag:
-            heading_text = heading_tag.get_text(strip=True)
-            if heading_text in ["Morphological description", "Habitat", "Distribution", "Flowering time", "Altitude"]:
-                paragraphs = body_tag.find_all('p')
-                body_text = "\n".join(p.get_text(strip=True) for p in paragraphs if p.get_text(strip=True))
-                if body_text:
-                    extracted_data.append(f"--- {heading_text} ---\n{body_text}")
-
-    if extracted_data:
-        full_text = "\n\n".join(extracted_data)
-        return (True, f"--- According to e-Flora of South Africa (SANBI) ---\n\n{full_text}")
-
-    return (False, "e-Flora SA page found, but no relevant description sections could be parsed.")
+    with span('parse_eflora'):
+        return parse_eflorasa_description(html_content)
 
 # --- Gemini AI Analysis (MODIFIED) ---
-def analyze_with_gemini(scraped_descriptions, user_input, failed_species_list):
-    """Uses the Gemini model to analyze scraped data and a unified user input."""
-    print("\nAnalyzing with Gemini...")
-    prompt = f"""
+OMITTED_BY_RANKING = "ranked less relevant to the specimen by a local pre-filter"
+OMITTED_BY_SCREENING = "screened out as poor matches in a first pass over all candidates"
+
+def _build_analysis_prompt(scraped_descriptions, user_input, failed_species_list, lower_ranked_species_list,
+                           omitted_reason=OMITTED_BY_RANKING, screening_notes=""):
+    notes_section = f"""
+    **Notes From the First-Pass Screening of All Candidates:**
+    {screening_notes}
+    ---""" if screening_notes else ""
+    return f"""
     You are an expert botanist and taxonomist. Your task is to compare provided descriptions with observations from a herbarium specimen.
 
     **Collected Botanical Descriptions:**
     {scraped_descriptions if scraped_descriptions else "No descriptions were successfully scraped."}
-    ---
+    ---{notes_section}
     **Species Found on GBIF but Lacking a Scraped Description:**
     {failed_species_list if failed_species_list else "None"}
     ---
+    **Species With Descriptions Omitted for Length ({omitted_reason}):**
+    {lower_ranked_species_list if lower_ranked_species_list else "None"}
+    ---
     **User-Provided Specimen Details (Morphology & Locality):**
     {user_input if user_input else "No specific specimen details were provided."}
     ---
@@ -207,17 +448,160 @@ def analyze_with_gemini(scraped_descriptions, user_input, failed_species_list):
     ### **Most Likely Candidates**
     - Identify the top 1-2 most likely candidate species from the ones with available descriptions.
     ### **Species Lacking Descriptions**
-    - List the species recorded in the area that could not be automatically retrieved. Advise the user that these are still valid possibilities.
+    - List the species recorded in the area that could not be automatically retrieved. Advise the user that these are still valid possibilities. Mention briefly that the omitted species were not compared in detail.
     ### **Further Steps for Confirmation**
     - Suggest concrete actions to confirm the identification.
     ### **Confidence Level**
     - State your confidence in the potential identification based ONLY on the available scraped data.
     """
+
+@instrumented('gemini_generate')
+def _generate(prompt):
+    """Sends one prompt to Gemini and returns the text, or None if the response was blocked or empty."""
+    annotate(prompt_chars=len(prompt))
+    model = get_model()
+    response = model.generate_content(prompt)
+    if not response.parts:
+        return None
+    annotate(response_chars=len(response.text))
+    return response.text
+
+def _stream_final_report(prompt, status=None):
+    """Streams a report prompt, yielding text chunks.
+
+    Failures are yielded as a readable message; if a `status` dict is given, the error is
+    also stored in status['error'] so callers can tell a failed analysis from a report.
+    """
+    produced = False
+    # The span stays open across yields, so it is recorded by hand.
+    started, first_chunk_seconds, response_chars = time.perf_counter(), None, 0
     try:
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt)
-        if not response.parts:
-            return "Analysis was blocked by the safety filter or returned no content."
-        return response.text
+        model = get_model()
+        for chunk in model.generate_content(prompt, stream=True):
+            if chunk.parts:
+                produced = True
+                if first_chunk_seconds is None:
+                    first_chunk_seconds = round(time.perf_counter() - started, 6)
+                response_chars += len(chunk.text)
+                yield chunk.text
     except Exception as e:
-        return f"An error occurred during Gemini analysis: {e}"
\ No newline at end of file
+        record('gemini_stream', started, prompt_chars=len(prompt), error=type(e).__name__)
+        if status is not None:
+            status['error'] = f"{type(e).__name__}: {e}"
+        separator = "\n\n" if produced else ""
+        yield f"{separator}An error occurred during Gemini analysis: {e}"
+        return
+    record('gemini_stream', started, prompt_chars=len(prompt), response_chars=response_chars,
+           first_chunk_seconds=first_chunk_seconds)
+    if not produced:
+        yield "Analysis was blocked by the safety filter or returned no content."
+
+def stream_gemini_analysis(scraped_descriptions, user_input, failed_species_list, lower_ranked_species_list="",
+                           status=None):
+    """Like analyze_with_gemini, but yields the report text as Gemini generates it (see _stream_final_report)."""
+    print("\nAnalyzing with Gemini...")
+    prompt = _build_analysis_prompt(scraped_descriptions, user_input, failed_species_list, lower_ranked_species_list)
+    yield from _stream_final_report(prompt, status)
+
+def analyze_with_gemini(scraped_descriptions, user_input, failed_species_list, lower_ranked_species_list=""):
+    """Uses the Gemini model to analyze scraped data and a unified user input."""
+    return "".join(stream_gemini_analysis(scraped_descriptions, user_input, failed_species_list, lower_ranked_species_list))
+
+def _chunk_species(species_entries, chunk_tokens):
+    """Splits species into consecutive chunks whose descriptions total at most `chunk_tokens`."""
+    chunks, current, current_tokens = [], [], 0
+    for entry in species_entries:
+        tokens = estimate_tokens(entry['description'])
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(entry)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+@instrumented('gemini_shortlist')
+def _shortlist_chunk(chunk, user_input):
+    """Map step: asks Gemini for the best matches within one chunk, retrying only this chunk on failure.
+
+    Retries back off with jitter (GEMINI_CHUNK_BACKOFF_*), so that a quota error has time to
+    clear. Returns (notes, shortlisted names), or None if every attempt failed.
+    """
+    descriptions = "\n\n".join(f"--- Data for {s['name']} ---\n{s['description']}" for s in chunk)
+    prompt = f"""
+    You are an expert botanist and taxonomist screening candidate species for a herbarium specimen.
+
+    **Candidate Descriptions:**
+    {descriptions}
+    ---
+    **User-Provided Specimen Details (Morphology & Locality):**
+    {user_input if user_input else "No specific specimen details were provided."}
+    ---
+    **Your Task:**
+    Shortlist at most {GEMINI_SHORTLIST_SIZE} of the candidates above that could plausibly match the specimen.
+    For each shortlisted species give one or two lines on the features that agree or conflict.
+    Finish with a single line of the form `SHORTLIST: Species one; Species two`, or `SHORTLIST: none`.
+    """
+    names_by_key = {s['name'].lower(): s['name'] for s in chunk}
+    for attempt in range(GEMINI_CHUNK_RETRIES + 1):
+        if attempt:
+            wait = backoff_delay(attempt - 1, GEMINI_CHUNK_BACKOFF_BASE_SECONDS, GEMINI_CHUNK_BACKOFF_MAX_SECONDS)
+            print(f"--> Retrying the chunk in {wait:.1f} seconds...")
+            time.sleep(wait)
+        try:
+            text = _generate(prompt)
+        except Exception as e:
+            print(f"--> Screening attempt {attempt + 1} failed for a chunk of {len(chunk)} species: {e}")
+            continue
+        if text is None:
+            print(f"--> Screening attempt {attempt + 1} returned no content for a chunk of {len(chunk)} species.")
+            continue
+        match = re.search(r"SHORTLIST:\s*(.*)", text)
+        proposed = [name.strip(" *`.").lower() for name in match.group(1).split(';')] if match else []
+        shortlisted = [names_by_key[name] for name in proposed if name in names_by_key]
+        notes = text[:match.start()].strip() if match else text.strip()
+        return notes, shortlisted
+    return None
+
+def stream_gemini_map_reduce(species_entries, user_input, failed_species_list, status=None):
+    """Analyses a large candidate set in two passes, yielding the final report as it streams.
+
+    The descriptions are split into chunks of about GEMINI_CHUNK_TOKENS, each chunk is
+    screened in parallel (map), and a final call compares the shortlisted species in
+    full and writes the usual report (reduce). If the shortlist itself exceeds
+    PROMPT_TOKEN_BUDGET, only its best-ranked descriptions that fit go into the final call.
+    """
+    chunks = _chunk_species(species_entries, GEMINI_CHUNK_TOKENS)
+    print(f"\nAnalyzing with Gemini in {len(chunks)} chunks (map-reduce)...")
+    with ThreadPoolExecutor(max_workers=GEMINI_MAP_WORKERS) as executor:
+        results = list(executor.map(bind(lambda chunk: _shortlist_chunk(chunk, user_input)), chunks))
+
+    notes, shortlisted, unscreened = [], set(), []
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            unscreened.extend(s['name'] for s in chunk)
+            continue
+        chunk_notes, chunk_shortlist = result
+        notes.append(chunk_notes)
+        shortlisted.update(chunk_shortlist)
+    if unscreened:
+        print(f"--> {len(unscreened)} species could not be screened; their descriptions go to the final step.")
+        shortlisted.update(unscreened)
+
+    finalists = [s for s in species_entries if s['name'] in shortlisted]
+    finalists, over_budget = select_descriptions(finalists, user_input, len(finalists), PROMPT_TOKEN_BUDGET)
+    if over_budget:
+        print(f"--> {len(over_budget)} shortlisted species exceed the prompt budget; only their names go to the final step.")
+    screened_out = "\n".join(
+        [f"- {s['name']}" for s in species_entries if s['name'] not in shortlisted]
+        + [f"- {s['name']} (shortlisted, but ranked below the prompt budget)" for s in over_budget]
+    )
+    descriptions = "\n\n".join(f"--- Data for {s['name']} ---\n{s['description']}" for s in finalists)
+    prompt = _build_analysis_prompt(descriptions, user_input, failed_species_list, screened_out,
+                                    omitted_reason=OMITTED_BY_SCREENING, screening_notes="\n\n".join(notes))
+    yield from _stream_final_report(prompt, status)
+
+def analyze_with_gemini_map_reduce(species_entries, user_input, failed_species_list):
+    """Map-reduce analysis for large candidate sets; see stream_gemini_map_reduce."""
+    return "".join(stream_gemini_map_reduce(species_entries, user_input, failed_species_list))
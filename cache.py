@@ -0,0 +1,169 @@
+# cache.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+import instrumentation
+from config import CACHE_ENABLED, CACHE_DIR, CACHE_TTL_SECONDS, CACHE_NEGATIVE_TTL_SECONDS, CACHE_MAX_BYTES
+
+class DiskCache:
+    """A small SQLite key/value store with per-entry expiry and least-recently-used eviction.
+
+    The total size of all entries is kept in the `meta` table by triggers, so a write
+    only scans the entries when the cache has grown past `max_bytes`.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Makes INSERT OR REPLACE fire the delete trigger for the row it replaces.
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "last_access REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # Seeds the running total once for caches created before it was kept.
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (name, value) "
+            "SELECT 'total_size', COALESCE(SUM(size), 0) FROM entries"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_insert AFTER INSERT ON entries BEGIN "
+            "UPDATE meta SET value = value + NEW.size WHERE name = 'total_size'; END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_delete AFTER DELETE ON entries BEGIN "
+            "UPDATE meta SET value = value - OLD.size WHERE name = 'total_size'; END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_update AFTER UPDATE OF size ON entries BEGIN "
+            "UPDATE meta SET value = value + NEW.size - OLD.size WHERE name = 'total_size'; END"
+        )
+        self._conn.execute("COMMIT")
+
+    def get(self, key):
+        """Returns (True, value) for a live entry, otherwise (False, None)."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return False, None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        """Stores a JSON-serialisable value for `ttl` seconds, evicting old entries if over the size cap."""
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items, ttl):
+        """Stores (key, value) pairs for `ttl` seconds in a single transaction."""
+        now = time.time()
+        rows = []
+        for key, value in items:
+            payload = json.dumps(value)
+            rows.append((key, payload, now + ttl, now, len(payload)))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, last_access, size) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._evict()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def items(self, prefix):
+        """Returns (key, value) for every live entry whose key starts with `prefix`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM entries WHERE key >= ? AND key < ? AND expires_at >= ?",
+                (prefix, prefix + "\uffff", time.time()),
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def _total_size(self):
+        return self._conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+
+    def _evict(self):
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        self._conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall()
+        total = sum(size for _, size in rows)
+        # Trim to 90% of the cap so we are not evicting on every write.
+        target = self.max_bytes * 0.9
+        stale = []
+        for key, size in rows:
+            if total <= target:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the process-wide cache, opening the database under CACHE_DIR on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            _cache = DiskCache(os.path.join(CACHE_DIR, "cache.sqlite3"), CACHE_MAX_BYTES)
+        return _cache
+
+def normalise_name(scientific_name):
+    """Builds a cache key from a scientific name: the lower-cased binomial."""
+    return " ".join(scientific_name.split()[:2]).lower()
+
+def cached(namespace, key_func, is_negative, ttl=None, negative_ttl=None):
+    """Decorator caching a single-argument lookup on disk.
+
+    `key_func` maps the argument to a cache key and `is_negative` decides whether a
+    result is a failure, which is kept for the shorter negative TTL.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(arg):
+            if not CACHE_ENABLED:
+                return func(arg)
+            key = f"{namespace}:{key_func(arg)}"
+            cache = get_cache()
+            hit, entry = cache.get(key)
+            instrumentation.count('cache_hit' if hit else 'cache_miss', namespace=namespace)
+            instrumentation.annotate(cache='hit' if hit else 'miss')
+            if hit:
+                value = entry['value']
+                return tuple(value) if entry['tuple'] else value
+            result = func(arg)
+            negative = is_negative(result)
+            entry_ttl = (negative_ttl or CACHE_NEGATIVE_TTL_SECONDS) if negative else (ttl or CACHE_TTL_SECONDS)
+            cache.set(key, {'value': result, 'tuple': isinstance(result, tuple)}, entry_ttl)
+            return result
+        return wrapper
+    return decorator
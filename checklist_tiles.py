@@ -0,0 +1,144 @@
+# checklist_tiles.py
+
+"""Geohash-tiled cache of GBIF occurrence coordinates for checklist queries.
+
+Occurrences are cached per (taxon key, geohash cell) with their coordinates. A radius
+query is answered from the cells that overlap the circle: cached cells are read from
+disk and only the missing ones are fetched from GBIF, after which the exact radius is
+applied locally. Queries a few hundred metres apart share almost all of their cells.
+"""
+
+import math
+
+from cache import get_cache
+from config import CACHE_ENABLED, GBIF_TILE_PRECISION, GBIF_TILE_TTL_SECONDS
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0088
+# A missing block is fetched with one bounding-box query when its cells fill at least
+# this fraction of the box; otherwise each row of adjacent missing cells is fetched separately.
+MIN_BLOCK_FILL = 0.5
+
+def _grid(precision):
+    """Returns (lat_cells, lon_cells, lat_size, lon_size) for a geohash precision."""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision // 2
+    return 2 ** lat_bits, 2 ** lon_bits, 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+def geohash(row, col, precision=GBIF_TILE_PRECISION):
+    """Geohash string of the cell at grid row (latitude) and column (longitude)."""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision // 2
+    value, lon_left, lat_left = 0, lon_bits, lat_bits
+    # Geohash interleaves the bits of both indices, starting with longitude.
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_left -= 1
+            value = (value << 1) | ((col >> lon_left) & 1)
+        else:
+            lat_left -= 1
+            value = (value << 1) | ((row >> lat_left) & 1)
+    return "".join(GEOHASH_ALPHABET[(value >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+def cell_of(latitude, longitude, precision=GBIF_TILE_PRECISION):
+    """Grid (row, col) of the cell containing a coordinate."""
+    lat_cells, lon_cells, lat_size, lon_size = _grid(precision)
+    row = min(max(int((latitude + 90.0) // lat_size), 0), lat_cells - 1)
+    col = int((longitude + 180.0) // lon_size) % lon_cells
+    return row, col
+
+def cell_bounds(cell, precision=GBIF_TILE_PRECISION):
+    """(min_lat, max_lat, min_lon, max_lon) of a cell."""
+    _, _, lat_size, lon_size = _grid(precision)
+    row, col = cell
+    return row * lat_size - 90.0, (row + 1) * lat_size - 90.0, col * lon_size - 180.0, (col + 1) * lon_size - 180.0
+
+def _distance_to_cell_km(latitude, longitude, cell, precision):
+    """Great-circle distance from a point to the nearest point of a cell."""
+    min_lat, max_lat, min_lon, max_lon = cell_bounds(cell, precision)
+    nearest_lat = min(max(latitude, min_lat), max_lat)
+    nearest_lon = min(max(longitude, min_lon), max_lon)
+    lat1, lat2 = math.radians(latitude), math.radians(nearest_lat)
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(nearest_lon - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+def covering_cells(latitude, longitude, radius_km, precision=GBIF_TILE_PRECISION):
+    """Cells that overlap the circle, sorted by (row, col)."""
+    lat_cells, lon_cells, lat_size, lon_size = _grid(precision)
+    lat_offset = radius_km / KM_PER_DEGREE
+    lon_offset = min(radius_km / (KM_PER_DEGREE * max(abs(math.cos(math.radians(latitude))), 1e-6)), 180.0)
+    first_row, first_col = cell_of(latitude - lat_offset, longitude - lon_offset, precision)
+    last_row, _ = cell_of(latitude + lat_offset, longitude + lon_offset, precision)
+    col_count = min(int((longitude + lon_offset + 180.0) // lon_size) - int((longitude - lon_offset + 180.0) // lon_size) + 1,
+                    lon_cells)
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        for step in range(col_count):
+            cell = (row, (first_col + step) % lon_cells)
+            if _distance_to_cell_km(latitude, longitude, cell, precision) <= radius_km:
+                cells.add(cell)
+    return sorted(cells)
+
+def plan_fetches(cells):
+    """Groups missing cells into blocks that can each be fetched with one bounding-box query."""
+    if not cells:
+        return []
+    rows = [row for row, _ in cells]
+    cols = [col for _, col in cells]
+    box_area = (max(rows) - min(rows) + 1) * (max(cols) - min(cols) + 1)
+    if len(cells) >= MIN_BLOCK_FILL * box_area:
+        return [sorted(cells)]
+    blocks = []
+    for cell in sorted(cells):
+        previous = blocks[-1][-1] if blocks else None
+        if previous and previous[0] == cell[0] and previous[1] + 1 == cell[1]:
+            blocks[-1].append(cell)
+        else:
+            blocks.append([cell])
+    return blocks
+
+def block_bounds(block, precision=GBIF_TILE_PRECISION):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing all cells of a block."""
+    bounds = [cell_bounds(cell, precision) for cell in block]
+    return (min(b[0] for b in bounds), max(b[1] for b in bounds),
+            min(b[2] for b in bounds), max(b[3] for b in bounds))
+
+def split_records(block, records, precision=GBIF_TILE_PRECISION):
+    """Sorts (lat, lon, species_key, name) records into tiles for the cells of a block.
+
+    Records falling in cells outside the block (the bounding box of a sparse block, or
+    points on a shared edge) are dropped so each record is stored in exactly one tile.
+    """
+    tiles = {cell: {'lats': [], 'lons': [], 'keys': [], 'names': {}} for cell in block}
+    for latitude, longitude, species_key, name in records:
+        tile = tiles.get(cell_of(latitude, longitude, precision))
+        if tile is not None:
+            tile['lats'].append(latitude)
+            tile['lons'].append(longitude)
+            tile['keys'].append(species_key)
+            tile['names'][str(species_key)] = name
+    return tiles
+
+def _tile_key(taxon_key, cell, precision):
+    return f"gbif-tile:{taxon_key}:{geohash(*cell, precision=precision)}"
+
+def load_tiles(taxon_key, cells, precision=GBIF_TILE_PRECISION):
+    """Returns {cell: tile} for the cells that are cached."""
+    if not CACHE_ENABLED:
+        return {}
+    cache = get_cache()
+    tiles = {}
+    for cell in cells:
+        hit, tile = cache.get(_tile_key(taxon_key, cell, precision))
+        if hit:
+            tiles[cell] = tile
+    return tiles
+
+def store_tiles(taxon_key, tiles, precision=GBIF_TILE_PRECISION):
+    if not CACHE_ENABLED:
+        return
+    get_cache().set_many(
+        [(_tile_key(taxon_key, cell, precision), tile) for cell, tile in tiles.items()], GBIF_TILE_TTL_SECONDS
+    )
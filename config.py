@@ -7,6 +7,10 @@
 # Example: GOOGLE_API_KEY = "YOUR_API_KEY_HERE"
 
 MODEL_NAME = "models/gemini-2.5-flash"
+# Service endpoints. The benchmark harness points these at local stand-in servers.
+GBIF_API_URL = "https://api.gbif.org/v1/"
+POWO_BASE_URL = "https://powo.science.kew.org"
+SANBI_BASE_URL = "https://biodiversityadvisor.sanbi.org"
 HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
 
 # --- Default Search Parameters ---
@@ -14,4 +18,132 @@ HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/
 DEFAULT_LATITUDE = -34.459745
 DEFAULT_LONGITUDE = 20.4001533333
 DEFAULT_RADIUS_KM = 4
-DEFAULT_TAXON_NAME = "Thymelaeaceae"
\ No newline at end of file
+DEFAULT_TAXON_NAME = "Thymelaeaceae"
+
+# --- Concurrency and Rate Limiting ---
+# Number of species whose descriptions are fetched in parallel.
+MAX_WORKERS = 6
+# Token-bucket limits per host (or host:port) as (requests per second, burst size).
+# These replace the old fixed pause between species.
+HOST_RATE_LIMITS = {
+    "biodiversityadvisor.sanbi.org": (2.0, 4),
+    "powo.science.kew.org": (2.0, 4),
+    "api.gbif.org": (10.0, 20),
+}
+DEFAULT_RATE_LIMIT = (1.0, 2)
+
+# --- Persistent Cache ---
+# Name lookups and scraped descriptions are cached on disk between runs.
+CACHE_ENABLED = True
+CACHE_DIR = ".flora_cache"
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+# Lookups and scrapes that found nothing are retried sooner than successful ones;
+# network failures are not cached at all.
+CACHE_NEGATIVE_TTL_SECONDS = 6 * 3600
+# Least recently used entries are evicted once the cache grows past this size.
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# --- GBIF Species Listing ---
+# "facet" counts records per species in one request using an exact radius filter;
+# "occurrences" pages through the records and filters them by great-circle distance;
+# "tiles" is like "occurrences" but caches the records per geohash cell, so nearby
+# queries only fetch the cells they do not share with earlier ones. Areas with more
+# than GBIF_MAX_RECORDS uncached records fall back to "facet" in "tiles" mode.
+GBIF_LISTING_MODE = "tiles"
+GBIF_FACET_LIMIT = 2000
+GBIF_PAGE_SIZE = 300
+# Upper bound on records paged through per query in "occurrences" and "tiles" modes.
+GBIF_MAX_RECORDS = 20000
+# Geohash precision 5 cells are about 4.9 x 4.9 km at the equator.
+GBIF_TILE_PRECISION = 5
+GBIF_TILE_TTL_SECONDS = 7 * 24 * 3600
+
+# --- Local Occurrence Index ---
+# Build with `python occurrence_index.py ingest <GBIF download>`. When an index
+# covering the query area exists, species lists are answered from it offline.
+USE_LOCAL_OCCURRENCE_INDEX = True
+OCCURRENCE_INDEX_DIR = ".flora_index"
+OCCURRENCE_INDEX_GRID_DEGREES = 0.1
+# Query the GBIF API when the local index is missing or does not cover the query.
+GBIF_NETWORK_FALLBACK = True
+
+# --- HTTP Client ---
+HTTP_TIMEOUT_SECONDS = 30
+# Attempts per request, including the first; retries back off exponentially with jitter.
+HTTP_MAX_ATTEMPTS = 4
+HTTP_BACKOFF_BASE_SECONDS = 1.0
+# Also caps how long a Retry-After header can make us wait.
+HTTP_BACKOFF_MAX_SECONDS = 30.0
+# ETag/Last-Modified validators (and the page body) are kept this long for conditional GETs.
+HTTP_VALIDATOR_TTL_SECONDS = 180 * 24 * 3600
+
+# --- HTML Parsing ---
+# "bs4" builds a full BeautifulSoup tree; "lxml" parses only the description
+# fragments of each page and is several times faster, but its output still differs
+# for block elements inside a <p> and for omitted end tags (see html_extract.py and
+# the fixtures checked by benchmarks/bench_html_parsers.py). "bs4" is used if lxml is missing.
+HTML_PARSER = "bs4"
+
+# --- Prompt Size ---
+# Descriptions are ranked locally against the specimen details, and only the best
+# RANKING_TOP_K that fit PROMPT_TOKEN_BUDGET are sent to Gemini in full.
+RANKING_ENABLED = True
+RANKING_TOP_K = 25
+PROMPT_TOKEN_BUDGET = 30000
+
+# --- Map-Reduce Analysis ---
+# "single" sends one prompt; "map_reduce" screens chunks of descriptions in
+# parallel and then compares the shortlisted species in a final call; "auto"
+# switches to map-reduce only when the RANKING_TOP_K best-ranked descriptions do not
+# fit PROMPT_TOKEN_BUDGET (without ranking: when all descriptions do not fit).
+GEMINI_ANALYSIS_MODE = "auto"
+GEMINI_CHUNK_TOKENS = 12000
+GEMINI_MAP_WORKERS = 4
+# Extra attempts for a chunk whose screening call fails; other chunks are not rerun.
+# They back off exponentially with jitter, long enough for a per-minute quota to refill.
+GEMINI_CHUNK_RETRIES = 2
+GEMINI_CHUNK_BACKOFF_BASE_SECONDS = 10.0
+GEMINI_CHUNK_BACKOFF_MAX_SECONDS = 60.0
+GEMINI_SHORTLIST_SIZE = 3
+
+# --- Batch Mode ---
+# batch.py runs this many specimen analyses against Gemini at once.
+BATCH_ANALYSIS_WORKERS = 3
+BATCH_OUTPUT_DIR = "batch_output"
+
+# --- Description Warehouse ---
+# Built with `python prefetch.py <taxon> --province <name>`. When it exists, stored
+# descriptions are used instead of scraping; species missing from it, or stored as
+# failed fetches, are scraped live if WAREHOUSE_LIVE_FALLBACK is set.
+WAREHOUSE_ENABLED = True
+WAREHOUSE_PATH = ".flora_warehouse/descriptions.sqlite3"
+WAREHOUSE_LIVE_FALLBACK = True
+# prefetch.py re-scrapes entries older than this.
+WAREHOUSE_REFRESH_DAYS = 30
+
+# --- Instrumentation ---
+# Times network calls, parsing and Gemini calls (see instrumentation.py); the run
+# profile is attached to the HTML report. Set METRICS_PORT to serve Prometheus
+# metrics at http://127.0.0.1:<port>/metrics from the Streamlit app.
+INSTRUMENTATION_ENABLED = True
+METRICS_PORT = None
+
+# --- Reports ---
+# Offer the app's HTML report download gzip-compressed (.html.gz).
+REPORT_COMPRESS = False
+
+# --- Fetch Deadlines ---
+# Start the POWO lookup alongside e-Flora SA once an e-Flora SA request has waited this
+# many seconds for its response; time queued in the SANBI rate limiter does not count
+# (a negative value disables hedging: POWO only after e-Flora fails).
+FETCH_HEDGE_DELAY_SECONDS = 2.0
+# Descriptions still pending this long after a run started are reported as not
+# retrieved in time, and the analysis goes ahead without them (None: no limit).
+RUN_TIME_BUDGET_SECONDS = 300
+
+# --- Name Index ---
+# Built with `python name_index.py build ...` from GBIF backbone, WCVP (POWO) and SANBI
+# name exports and/or earlier lookups in the cache. Known names skip the SANBI and POWO
+# search requests, and checklist entries are merged by accepted name.
+USE_NAME_INDEX = True
+NAME_INDEX_DIR = ".flora_names"
@@ -0,0 +1,216 @@
+# html_extract.py
+
+"""Description extraction for e-Flora SA and POWO pages.
+
+There are two implementations. The 'bs4' parsers build a full BeautifulSoup tree of
+the page. The 'lxml' parsers first cut the relevant elements out of the raw HTML (the
+POWO `section#descriptions`, the e-Flora `details-bordered` blocks), which is much like
+a SoupStrainer, and hand only those fragments to lxml's C parser.
+
+Their output is identical for well-formed markup, but not when end tags are left out
+or a block element sits inside a <p>. lxml closes an open <p>, <li>, <dt> or <dd> where
+the next one starts, as browsers do, while bs4's html.parser nests the next one inside
+it, so its text is repeated: `<p>Fynbos<p>Rocky` gives "Fynbos\nRocky" with lxml and
+"FynbosRocky\nRocky" with bs4. lxml also closes a <p> before a <div> or <ul>, whose
+text is then lost: `<p>Rocky <div>slopes</div></p>` gives "Rocky" with lxml and
+"Rockyslopes" with bs4. bs4 is therefore the default (config.HTML_PARSER) until the
+lxml parsers match it on the fixtures in benchmarks/fixtures.
+"""
+
+import re
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+from config import HTML_PARSER
+
+MORPHOLOGICAL_KEYWORDS = ['morphology', 'habit', 'leaves', 'stem', 'flowers', 'fruit', 'inflorescence', 'bracts', 'perianth', 'style', 'ecology', 'note', 'type']
+EFLORA_HEADINGS = ["Morphological description", "Habitat", "Distribution", "Flowering time", "Altitude"]
+
+def _format_powo_definition(definition):
+    return re.sub(r"([a-z])([A-Z])", r"\1\n\2", definition)
+
+def _powo_result(description_blocks):
+    """Formats (source, [(term, definition)]) pairs the same way for both parsers."""
+    all_descriptions_text = []
+    has_morphological_data = False
+    for source_text, rows in description_blocks:
+        all_descriptions_text.append(f"--- {source_text} ---\n")
+        for term, definition in rows:
+            if any(keyword in term.lower() for keyword in MORPHOLOGICAL_KEYWORDS): has_morphological_data = True
+            all_descriptions_text.append(f"{term}:\n{_format_powo_definition(definition)}\n")
+    if not has_morphological_data:
+        return (False, "No morphological description found on POWO.")
+    return (True, "\n".join(all_descriptions_text))
+
+def _eflora_result(extracted_data):
+    if extracted_data:
+        full_text = "\n\n".join(extracted_data)
+        return (True, f"--- According to e-Flora of South Africa (SANBI) ---\n\n{full_text}")
+    return (False, "e-Flora SA page found, but no relevant description sections could be parsed.")
+
+# --- BeautifulSoup implementation ---
+
+def _soup(html_content):
+    # bs4 is imported on first use: with the lxml parsers bs4 is never needed.
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_content, 'html.parser')
+
+def parse_powo_description_bs4(html_content):
+    soup = _soup(html_content)
+    descriptions_section = soup.find('section', id='descriptions')
+    if not descriptions_section: return (False, "No description section found on POWO page.")
+    description_blocks = descriptions_section.find_all('div', class_='description')
+    if not description_blocks: return (False, "Description section exists but contains no description blocks.")
+
+    parsed_blocks = []
+    for block in description_blocks:
+        source_text = "Unknown Source"
+        source_button = block.find('button', class_='collapser')
+        if source_button and source_button.find('span', class_='text'):
+            source_text = source_button.find('span', class_='text').get_text(strip=True)
+        rows = []
+        dl = block.find('dl', class_='c-article-desc-table')
+        if dl:
+            for dt, dd in zip(dl.find_all('dt'), dl.find_all('dd')):
+                term = ' '.join(span.get_text(strip=True) for span in dt.find_all('span'))
+                rows.append((term, dd.get_text(strip=True)))
+        parsed_blocks.append((source_text, rows))
+    return _powo_result(parsed_blocks)
+
+def parse_eflorasa_description_bs4(html_content):
+    soup = _soup(html_content)
+    extracted_data = []
+    for block in soup.find_all('div', class_='details-bordered'):
+        heading_tag = block.find('div', class_='details-bordered-heading')
+        body_tag = block.find('div', class_='details-bordered-body')
+        if heading_tag and body_tag:
+            heading_text = heading_tag.get_text(strip=True)
+            if heading_text in EFLORA_HEADINGS:
+                paragraphs = body_tag.find_all('p')
+                body_text = "\n".join(p.get_text(strip=True) for p in paragraphs if p.get_text(strip=True))
+                if body_text:
+                    extracted_data.append(f"--- {heading_text} ---\n{body_text}")
+    return _eflora_result(extracted_data)
+
+# --- lxml implementation ---
+
+_POWO_SECTION_START = re.compile(r"""<section\b[^>]*?(?<![\w-])id\s*=\s*(["']?)descriptions\1(?=[\s/>])""", re.IGNORECASE)
+_EFLORA_BLOCK_START = re.compile(r"""<div\b[^>]*?(?<![\w-])class\s*=\s*(["'])([^"']*)\1[^>]*>""", re.IGNORECASE)
+_TAG_PATTERNS = {}
+# BeautifulSoup leaves the contents of these elements out of get_text().
+_NON_TEXT_TAGS = {'script', 'style', 'template'}
+
+def _element_end(html_content, start, tag):
+    """Returns the index just past the end tag that closes the element opening at `start`."""
+    pattern = _TAG_PATTERNS.get(tag)
+    if pattern is None:
+        pattern = _TAG_PATTERNS[tag] = re.compile(rf"<(/?){tag}\b[^>]*>", re.IGNORECASE)
+    depth = 0
+    for match in pattern.finditer(html_content, start):
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                return match.end()
+        elif not match.group(0).endswith('/>'):
+            depth += 1
+    return len(html_content)
+
+def _parse_fragment(fragment):
+    """Parses an HTML snippet that starts with an element and returns that element."""
+    return lxml.html.fragment_fromstring(fragment, create_parent='div')[0]
+
+def _has_class(element, class_name):
+    return class_name in (element.get('class') or '').split()
+
+def _find_all(element, tag, class_name=None):
+    """Descendants (excluding `element`) matching `tag` and, optionally, a class token."""
+    return [node for node in element.iterdescendants(tag) if class_name is None or _has_class(node, class_name)]
+
+def _find(element, tag, class_name=None):
+    for node in element.iterdescendants(tag):
+        if class_name is None or _has_class(node, class_name):
+            return node
+    return None
+
+def _collect_text(node, parts):
+    if node.tag not in _NON_TEXT_TAGS and node.text:
+        parts.append(node.text)
+    for child in node:
+        # Comments and processing instructions have a non-string tag; only their tail is text.
+        if isinstance(child.tag, str):
+            _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+def _text(element):
+    """Equivalent of BeautifulSoup's get_text(strip=True)."""
+    parts = []
+    _collect_text(element, parts)
+    return "".join(stripped for stripped in (part.strip() for part in parts) if stripped)
+
+def parse_powo_description_lxml(html_content):
+    match = _POWO_SECTION_START.search(html_content)
+    if not match: return (False, "No description section found on POWO page.")
+    start = match.start()
+    descriptions_section = _parse_fragment(html_content[start:_element_end(html_content, start, 'section')])
+    description_blocks = _find_all(descriptions_section, 'div', 'description')
+    if not description_blocks: return (False, "Description section exists but contains no description blocks.")
+
+    parsed_blocks = []
+    for block in description_blocks:
+        source_text = "Unknown Source"
+        source_button = _find(block, 'button', 'collapser')
+        if source_button is not None:
+            source_span = _find(source_button, 'span', 'text')
+            if source_span is not None:
+                source_text = _text(source_span)
+        rows = []
+        dl = _find(block, 'dl', 'c-article-desc-table')
+        if dl is not None:
+            for dt, dd in zip(_find_all(dl, 'dt'), _find_all(dl, 'dd')):
+                term = ' '.join(_text(span) for span in _find_all(dt, 'span'))
+                rows.append((term, _text(dd)))
+        parsed_blocks.append((source_text, rows))
+    return _powo_result(parsed_blocks)
+
+def parse_eflorasa_description_lxml(html_content):
+    extracted_data = []
+    for match in _EFLORA_BLOCK_START.finditer(html_content):
+        if 'details-bordered' not in match.group(2).split():
+            continue
+        start = match.start()
+        block = _parse_fragment(html_content[start:_element_end(html_content, start, 'div')])
+        heading_tag = _find(block, 'div', 'details-bordered-heading')
+        body_tag = _find(block, 'div', 'details-bordered-body')
+        if heading_tag is not None and body_tag is not None:
+            heading_text = _text(heading_tag)
+            if heading_text in EFLORA_HEADINGS:
+                paragraph_texts = (_text(p) for p in _find_all(body_tag, 'p'))
+                body_text = "\n".join(text for text in paragraph_texts if text)
+                if body_text:
+                    extracted_data.append(f"--- {heading_text} ---\n{body_text}")
+    return _eflora_result(extracted_data)
+
+# --- Dispatch ---
+
+PARSERS = {
+    'bs4': (parse_powo_description_bs4, parse_eflorasa_description_bs4),
+    'lxml': (parse_powo_description_lxml, parse_eflorasa_description_lxml),
+}
+
+def _resolve_parser(parser):
+    parser = parser or HTML_PARSER
+    if parser == 'lxml' and lxml is None:
+        return 'bs4'
+    return parser
+
+def parse_powo_description(html_content, parser=None):
+    """Extracts the POWO description from a general-information page as (success, text_or_reason)."""
+    return PARSERS[_resolve_parser(parser)][0](html_content)
+
+def parse_eflorasa_description(html_content, parser=None):
+    """Extracts the e-Flora SA description sections as (success, text_or_reason)."""
+    return PARSERS[_resolve_parser(parser)][1](html_content)
@@ -0,0 +1,178 @@
+# http_client.py
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HEADERS, MAX_WORKERS, CACHE_ENABLED,
+    HTTP_TIMEOUT_SECONDS, HTTP_MAX_ATTEMPTS, HTTP_BACKOFF_BASE_SECONDS, HTTP_BACKOFF_MAX_SECONDS,
+    HTTP_VALIDATOR_TTL_SECONDS,
+)
+from rate_limit import throttle
+from cache import get_cache
+import instrumentation
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def backoff_delay(attempt, base=HTTP_BACKOFF_BASE_SECONDS, maximum=HTTP_BACKOFF_MAX_SECONDS):
+    """Seconds to wait before retry number `attempt + 1`: exponential backoff with full jitter."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+class HttpClient:
+    """Pooled HTTP client with one keep-alive session per host.
+
+    Each attempt waits on the host's rate limiter. Connection errors and retryable
+    statuses are retried with exponential backoff and full jitter, honouring
+    Retry-After. Pages fetched with `revalidate=True` keep their ETag/Last-Modified
+    so a later fetch can be answered with 304 Not Modified.
+    """
+    def __init__(self, max_attempts=HTTP_MAX_ATTEMPTS, timeout=HTTP_TIMEOUT_SECONDS,
+                 backoff_base=HTTP_BACKOFF_BASE_SECONDS, backoff_max=HTTP_BACKOFF_MAX_SECONDS):
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """Returns the keep-alive session for the host of `url`."""
+        host = urlparse(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._stats[host] = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0,
+                                     'retries': 0, 'not_modified': 0, 'failures': 0}
+            return session
+
+    def get(self, url, params=None, headers=None, revalidate=False):
+        """Sends a GET with retries and returns the final `requests.Response`.
+
+        Raises `requests.RequestException` once all attempts are used up. With
+        `revalidate=True` a 304 response gets the stored body of the previous 200.
+        """
+        session = self.session_for(url)
+        host = urlparse(url).netloc
+        validator_key = f"http-validators:{requests.Request('GET', url, params=params).prepare().url}"
+        stored = self._load_validators(validator_key) if revalidate else None
+        request_headers = dict(headers or {})
+        if stored:
+            if stored.get('etag'): request_headers['If-None-Match'] = stored['etag']
+            if stored.get('last_modified'): request_headers['If-Modified-Since'] = stored['last_modified']
+
+        for attempt in range(self.max_attempts):
+            throttle(url)
+            wait = None
+            try:
+                response = session.get(url, params=params, headers=request_headers, timeout=self.timeout)
+                self._record_request(host, session)
+                instrumentation.add('bytes', len(response.content))
+                if response.status_code == 304 and stored:
+                    self._bump(host, 'not_modified')
+                    instrumentation.count('http_not_modified', host=host)
+                    response.status_code = 200
+                    response._content = stored['body'].encode('utf-8')
+                    response.encoding = 'utf-8'
+                    return response
+                if response.status_code in RETRY_STATUSES and attempt < self.max_attempts - 1:
+                    wait = self._retry_after(response)
+                    print(f"--> {host} answered {response.status_code} (attempt {attempt + 1}).")
+                else:
+                    response.raise_for_status()
+                    if revalidate:
+                        self._store_validators(validator_key, response)
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_attempts - 1:
+                    self._bump(host, 'failures')
+                    raise
+                print(f"--> Network attempt {attempt + 1} for '{url}' failed: {e}")
+            except requests.exceptions.RequestException:
+                self._bump(host, 'failures')
+                raise
+            if wait is None:
+                wait = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            self._bump(host, 'retries')
+            instrumentation.add('retries')
+            print(f"--> Retrying in {wait:.1f} seconds...")
+            time.sleep(wait)
+
+    def get_json(self, url, params=None, headers=None):
+        return self.get(url, params=params, headers=headers).json()
+
+    def get_text(self, url, params=None, headers=None, revalidate=True):
+        return self.get(url, params=params, headers=headers, revalidate=revalidate).text
+
+    def stats(self):
+        """Returns a copy of the per-host request, connection-reuse and retry counters."""
+        with self._lock:
+            return {host: dict(counters) for host, counters in self._stats.items()}
+
+    def _retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoff_max, max(0.0, seconds))
+
+    def _record_request(self, host, session):
+        # urllib3 counts the connections each pool has opened; every other request reused one.
+        opened = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        with self._lock:
+            counters = self._stats[host]
+            counters['requests'] += 1
+            counters['connections_opened'] = max(counters['connections_opened'], opened)
+            counters['connections_reused'] = counters['requests'] - counters['connections_opened']
+
+    def _bump(self, host, counter):
+        with self._lock:
+            self._stats[host][counter] += 1
+
+    def _load_validators(self, key):
+        if not CACHE_ENABLED:
+            return None
+        hit, stored = get_cache().get(key)
+        return stored if hit else None
+
+    def _store_validators(self, key, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if CACHE_ENABLED and (etag or last_modified):
+            get_cache().set(key, {'etag': etag, 'last_modified': last_modified, 'body': response.text},
+                            HTTP_VALIDATOR_TTL_SECONDS)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide HTTP client shared by all fetch functions."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
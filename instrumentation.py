@@ -0,0 +1,323 @@
+# instrumentation.py
+
+"""Span-based timing of the pipeline's network calls, parse steps and Gemini calls.
+
+Wrap a step in `with span('name'):` or decorate it with `@instrumented('name')`, and
+attach details to the innermost open span with `annotate(...)` or `add('bytes', n)`.
+Finished spans are aggregated per name for the Prometheus text export, and are also
+recorded in the active `Profile`, if any, which is the JSON run profile attached to
+the HTML report. The active profile and span are context variables, so work handed to
+a thread pool must be wrapped with `bind()` to stay in the run's profile.
+
+With INSTRUMENTATION_ENABLED off, `instrumented` returns the function unchanged and
+`span` returns a shared no-op object.
+"""
+
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import INSTRUMENTATION_ENABLED
+
+# Upper bounds (seconds) of the Prometheus duration histogram buckets.
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "flora"
+
+_profile = contextvars.ContextVar('instrumentation_profile', default=None)
+_span = contextvars.ContextVar('instrumentation_span', default=None)
+_span_ids = itertools.count(1)
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """One timed step. Attributes set on it end up in the run profile."""
+    def __init__(self, name, attrs):
+        self.name = name
+        self.id = next(_span_ids)
+        self.attrs = attrs
+        self.parent = None
+        self.started = None
+        self.duration = None
+        self._tokens = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def __enter__(self):
+        parent = _span.get()
+        self.parent = parent.id if parent is not None else None
+        self._tokens = (_span.set(self), _profile.get())
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.started
+        token, profile = self._tokens
+        _span.reset(token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _registry.observe(self)
+        if profile is not None:
+            profile.record(self)
+        return False
+
+def span(name, **attrs):
+    """Context manager timing a step as a span called `name`."""
+    if not INSTRUMENTATION_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+def instrumented(name):
+    """Decorator running every call of the function in a span called `name`."""
+    def decorator(func):
+        if not INSTRUMENTATION_ENABLED:
+            return func
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attrs):
+    """Sets attributes on the innermost open span, if any."""
+    current = _span.get()
+    if current is not None:
+        current.set(**attrs)
+
+def add(key, amount=1):
+    """Adds to a numeric attribute of the innermost open span, if any."""
+    current = _span.get()
+    if current is not None:
+        current.add(key, amount)
+
+def record(name, started, **attrs):
+    """Records a span that started at perf_counter() value `started` and ends now.
+
+    For steps that cannot be wrapped in a `with` block, such as a generator that yields
+    while the step is still running.
+    """
+    if not INSTRUMENTATION_ENABLED:
+        return
+    finished = Span(name, attrs)
+    parent = _span.get()
+    finished.parent = parent.id if parent is not None else None
+    finished.started = started
+    finished.duration = time.perf_counter() - started
+    _registry.observe(finished)
+    profile = _profile.get()
+    if profile is not None:
+        profile.record(finished)
+
+def count(event, **labels):
+    """Counts an event that is not a span, e.g. a cache hit."""
+    if INSTRUMENTATION_ENABLED:
+        _registry.increment(event, labels)
+        profile = _profile.get()
+        if profile is not None:
+            profile.increment(event, labels)
+
+def bind(func):
+    """Wraps `func` so it runs in the caller's profile and span, e.g. in a worker thread."""
+    profile, parent = _profile.get(), _span.get()
+    if profile is None and parent is None:
+        return func
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profile_token, span_token = _profile.set(profile), _span.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _span.reset(span_token)
+            _profile.reset(profile_token)
+    return wrapper
+
+# --- Run profiles ---
+
+class Profile:
+    """Spans and events recorded during one run."""
+    def __init__(self, label):
+        self.label = label
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._finished = None
+        self._spans = []
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """Makes this the current profile (and clears the current span) inside the block."""
+        profile_token, span_token = _profile.set(self), _span.set(None)
+        try:
+            yield self
+        finally:
+            _span.reset(span_token)
+            _profile.reset(profile_token)
+
+    def iterate(self, iterable):
+        """Yields from `iterable`, activating the profile only while it produces each item.
+
+        Use this inside generators, where the profile must not stay active across a yield.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.active():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, finished):
+        entry = {'id': finished.id, 'parent': finished.parent, 'name': finished.name,
+                 'start': round(finished.started - self._started, 6), 'duration': round(finished.duration, 6)}
+        entry.update(finished.attrs)
+        with self._lock:
+            self._spans.append(entry)
+
+    def increment(self, event, labels):
+        key = _label_key(event, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        return self
+
+    def to_dict(self):
+        """The run profile: every span, a per-name summary and the event counters."""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda entry: entry['start'])
+            counters = dict(self._counters)
+        summary = {}
+        for entry in spans:
+            stage = summary.setdefault(entry['name'], {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                                       'bytes': 0, 'retries': 0, 'errors': 0})
+            stage['count'] += 1
+            stage['total_seconds'] += entry['duration']
+            stage['max_seconds'] = max(stage['max_seconds'], entry['duration'])
+            stage['bytes'] += entry.get('bytes', 0)
+            stage['retries'] += entry.get('retries', 0)
+            stage['errors'] += 'error' in entry
+        for stage in summary.values():
+            stage['total_seconds'] = round(stage['total_seconds'], 6)
+            stage['max_seconds'] = round(stage['max_seconds'], 6)
+        end = self._finished if self._finished is not None else time.perf_counter()
+        return {'label': self.label, 'started_at': self.started_at, 'wall_seconds': round(end - self._started, 6),
+                'summary': summary, 'counters': counters, 'spans': spans}
+
+# --- Prometheus export ---
+
+def _label_key(event, labels):
+    return event + "".join(f",{key}={value}" for key, value in sorted(labels.items()))
+
+class _Registry:
+    """Process-wide aggregates of every finished span and counted event."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._events = {}
+
+    def observe(self, finished):
+        duration = finished.duration
+        with self._lock:
+            stage = self._spans.get(finished.name)
+            if stage is None:
+                stage = self._spans[finished.name] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                                                      'bytes': 0, 'retries': 0, 'errors': 0}
+            stage['count'] += 1
+            stage['sum'] += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stage['buckets'][i] += 1
+            stage['bytes'] += finished.attrs.get('bytes', 0)
+            stage['retries'] += finished.attrs.get('retries', 0)
+            stage['errors'] += 'error' in finished.attrs
+
+    def increment(self, event, labels):
+        key = (event, tuple(sorted(labels.items())))
+        with self._lock:
+            self._events[key] = self._events.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            spans = {name: dict(stage, buckets=list(stage['buckets'])) for name, stage in self._spans.items()}
+            return spans, dict(self._events)
+
+_registry = _Registry()
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels.items()) + "}"
+
+def prometheus_text():
+    """All aggregates in the Prometheus text exposition format."""
+    spans, events = _registry.snapshot()
+    name = f"{METRIC_PREFIX}_span_duration_seconds"
+    lines = [f"# HELP {name} Duration of pipeline steps.", f"# TYPE {name} histogram"]
+    for stage_name, stage in sorted(spans.items()):
+        for bound, cumulative in zip(DURATION_BUCKETS, stage['buckets']):
+            lines.append(f"{name}_bucket{_labels(span=stage_name, le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(span=stage_name, le='+Inf')} {stage['count']}")
+        lines.append(f"{name}_sum{_labels(span=stage_name)} {stage['sum']:.6f}")
+        lines.append(f"{name}_count{_labels(span=stage_name)} {stage['count']}")
+    for field, help_text in (('bytes', "Bytes received by pipeline steps."),
+                             ('retries', "HTTP retries made by pipeline steps."),
+                             ('errors', "Pipeline steps that raised an exception.")):
+        metric = f"{METRIC_PREFIX}_span_{field}_total"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{_labels(span=stage_name)} {stage[field]}" for stage_name, stage in sorted(spans.items())]
+    metric = f"{METRIC_PREFIX}_events_total"
+    lines += [f"# HELP {metric} Counted events such as cache hits.", f"# TYPE {metric} counter"]
+    for (event, labels), value in sorted(events.items()):
+        lines.append(f"{metric}{_labels(event=event, **dict(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Serves prometheus_text() at /metrics from a daemon thread; later calls are no-ops."""
+    global _server
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
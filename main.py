@@ -1,108 +1,378 @@
 # main.py
 
+import gzip
+import html
+import io
+import json
 import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import markdown
-import google.generativeai as genai
 
 # Import our custom modules
 import botanical_data as bd
 import config
+import instrumentation
+import ranking
+import rate_limit
+import warehouse
 
-# --- MODIFIED FUNCTION SIGNATURE ---
-def run_identification_process(latitude, longitude, radius_km, taxon_name, user_input):
-    """The main workflow for the botanical identification tool."""
-    # 1. Get species list from GBIF.
-    scientific_names = bd.get_species_list_from_gbif(latitude, longitude, radius_km, taxon_name)
+@instrumentation.instrumented('species')
+def fetch_species_description(name, ids=None):
+    """Retrieves a description for one species from the local warehouse, or by scraping.
 
-    if not scientific_names:
-        print("\nNo species found in the specified area. Halting process.")
-        return None, None
+    `ids` may carry the species' 'sanbi_id' and 'powo_id', as checklist entries do when the
+    local name index knows them; the SANBI and POWO searches are then skipped.
+    """
+    if config.WAREHOUSE_ENABLED:
+        store = warehouse.get_warehouse()
+        stored = store.get(name) if store else None
+        # A stored failure may have been transient, so it is treated like a missing entry.
+        if stored and stored['success']:
+            instrumentation.annotate(warehouse='hit')
+            print(f"--> [{name}] Using the stored description from the local warehouse.")
+            return stored
+        if store and not config.WAREHOUSE_LIVE_FALLBACK:
+            return stored or {'name': name, 'success': False, 'reason': "Not in the local description warehouse."}
+    return scrape_species_description(name, ids=ids)
 
-    print("\nProceeding to scrape descriptions for the following species:")
-    for name in scientific_names:
-        print(f"- {name}")
-
-    species_data = []
-
-    # 2. Loop through each species to scrape its data.
-    for name in scientific_names:
-        print(f"\n{'='*60}\nProcessing: {name}\n{'='*60}")
-        # ... (scraping logic remains the same) ...
-        description_found = False
-        clean_name = " ".join(name.split()[:2])
-        print("--- Attempting to scrape from e-Flora of South Africa (SANBI) ---")
+def _scrape_eflora(name, clean_name, sanbi_id=None):
+    """Returns an e-Flora SA result for the species, or None."""
+    print(f"--- [{name}] Attempting to scrape from e-Flora of South Africa (SANBI) ---")
+    if sanbi_id:
+        eflora_url = f"{config.SANBI_BASE_URL}/search/detail/{sanbi_id}"
+        print(f"--> [{name}] Using the e-Flora SA page from the local name index: {eflora_url}")
+    else:
         eflora_url = bd.find_eflorasa_url(clean_name)
-        if eflora_url:
-            success, description = bd.scrape_eflorasa_description(eflora_url)
-            if success:
-                print("--> SUCCESS: Found and scraped a valid description from e-Flora SA.")
-                species_data.append({'name': name, 'success': True, 'description': description})
-                description_found = True
-            else:
-                print(f"--> e-Flora SA scrape failed: {description}")
-        if not description_found:
-            print("\n--> e-Flora SA data not found or failed. Trying POWO as a fallback...")
-            taxon_id = bd.find_powo_taxon_id(clean_name)
-            if taxon_id:
-                target_url = f"https://powo.science.kew.org/taxon/{taxon_id}/general-information"
-                print(f"--> Scraping POWO URL: {target_url}")
-                success, description = bd.scrape_powo_description_from_html(target_url)
-                if success:
-                    print("--> SUCCESS: Found and scraped a valid description from POWO.")
-                    species_data.append({'name': name, 'success': True, 'description': description})
-                    description_found = True
-                else:
-                    print(f"--> POWO scrape failed: {description}")
-        if not description_found:
-            reason = "No valid description found on e-Flora SA or POWO."
-            print(f"--> FINAL RESULT: {reason}")
-            species_data.append({'name': name, 'success': False, 'reason': reason})
-        print("\n--> Processing complete for this species. Pausing for 2 seconds...")
-        time.sleep(2)
-
-    # 3. Prepare data for AI analysis.
+    if eflora_url:
+        success, description = bd.scrape_eflorasa_description(eflora_url)
+        if success:
+            print(f"--> [{name}] SUCCESS: Found and scraped a valid description from e-Flora SA.")
+            return {'name': name, 'success': True, 'source': 'e-Flora SA', 'description': description}
+        print(f"--> [{name}] e-Flora SA scrape failed: {description}")
+    return None
+
+def _scrape_powo(name, clean_name, cancelled=None, powo_id=None):
+    """Returns a POWO result for the species, or None; gives up between requests once `cancelled` is set."""
+    taxon_id = powo_id or bd.find_powo_taxon_id(clean_name)
+    if taxon_id and not (cancelled and cancelled.is_set()):
+        target_url = f"{config.POWO_BASE_URL}/taxon/{taxon_id}/general-information"
+        print(f"--> [{name}] Scraping POWO URL: {target_url}")
+        success, description = bd.scrape_powo_description_from_html(target_url)
+        if success:
+            print(f"--> [{name}] SUCCESS: Found and scraped a valid description from POWO.")
+            return {'name': name, 'success': True, 'source': 'POWO', 'description': description}
+        print(f"--> [{name}] POWO scrape failed: {description}")
+    return None
+
+class _RequestWatch:
+    """Tracks how long the e-Flora SA request in flight has been waiting for its response.
+
+    Fed by rate_limit.watch_requests, so time spent queueing in the SANBI rate limiter
+    does not count towards the hedge delay.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sent_at = None
+        self._finished = False
+
+    def queued(self):
+        with self._condition:
+            self._sent_at = None
+
+    def sent(self):
+        with self._condition:
+            self._sent_at = time.monotonic()
+            self._condition.notify_all()
+
+    def finish(self):
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def stalled(self, delay):
+        """Blocks until one request has been in flight for `delay` seconds (True) or finish() (False)."""
+        with self._condition:
+            while not self._finished:
+                remaining = None if self._sent_at is None else self._sent_at + delay - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return True
+                self._condition.wait(remaining)
+            return False
+
+@instrumentation.instrumented('powo_hedge')
+def _hedged_powo(name, clean_name, hedge_delay, eflora, cancelled, powo_id=None):
+    # Starts once an e-Flora SA request has gone `hedge_delay` seconds without a response, or
+    # as soon as e-Flora SA has finished; skipped if it succeeded.
+    hedged = eflora.stalled(hedge_delay)
+    if cancelled.is_set():
+        instrumentation.annotate(started=False)
+        return None
+    if hedged:
+        print(f"--> [{name}] No e-Flora SA description after {hedge_delay}s. Starting POWO in parallel...")
+    instrumentation.annotate(started=True, hedged=hedged)
+    return _scrape_powo(name, clean_name, cancelled, powo_id)
+
+_hedge_executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS, thread_name_prefix='powo-hedge')
+
+def scrape_species_description(name, hedge_delay=None, ids=None):
+    """Scrapes a description for one species, preferring e-Flora SA and falling back to POWO.
+
+    With a hedge delay (FETCH_HEDGE_DELAY_SECONDS by default) the POWO lookup starts
+    alongside e-Flora SA once an e-Flora SA request has been waiting that many seconds
+    for its response, and is abandoned if a description arrives; e-Flora SA wins when
+    both succeed.
+    A negative delay tries the sources strictly one after the other. `ids` is as in
+    fetch_species_description.
+    """
+    print(f"\n{'='*60}\nProcessing: {name}\n{'='*60}")
+    clean_name = " ".join(name.split()[:2])
+    sanbi_id, powo_id = (ids or {}).get('sanbi_id'), (ids or {}).get('powo_id')
+    hedge_delay = config.FETCH_HEDGE_DELAY_SECONDS if hedge_delay is None else hedge_delay
+    if hedge_delay < 0:
+        result = _scrape_eflora(name, clean_name, sanbi_id)
+        if result is None:
+            print(f"--> [{name}] e-Flora SA data not found or failed. Trying POWO as a fallback...")
+            result = _scrape_powo(name, clean_name, powo_id=powo_id)
+    else:
+        eflora, cancelled = _RequestWatch(), threading.Event()
+        powo = _hedge_executor.submit(instrumentation.bind(_hedged_powo), name, clean_name, hedge_delay,
+                                      eflora, cancelled, powo_id)
+        try:
+            with rate_limit.watch_requests(eflora.queued, eflora.sent):
+                result = _scrape_eflora(name, clean_name, sanbi_id)
+        except BaseException:
+            cancelled.set()
+            eflora.finish()
+            raise
+        if result is not None:
+            cancelled.set()
+        else:
+            print(f"--> [{name}] e-Flora SA data not found or failed. Using POWO as a fallback...")
+        eflora.finish()
+        if result is None:
+            result = powo.result()
+    if result is not None:
+        return result
+    reason = "No valid description found on e-Flora SA or POWO."
+    print(f"--> [{name}] FINAL RESULT: {reason}")
+    return {'name': name, 'success': False, 'reason': reason}
+
+def iter_analysis(species_data, user_input):
+    """Analyses fetched species results against the specimen details.
+
+    Yields 'analysis_chunk' events while Gemini streams and finishes with a 'done' event,
+    as in iter_identification_process. The done event's 'error' is set when the Gemini call
+    failed; 'analysis' then holds the error message rather than a report.
+    """
     successful_scrapes = [s for s in species_data if s['success']]
     failed_species = [s for s in species_data if not s['success']]
-    combined_descriptions = "\n\n".join([f"--- Data for {s['name']} ---\n{s['description']}" for s in successful_scrapes])
     failed_species_list_str = "\n".join([f"- {s['name']}" for s in failed_species])
 
     if not successful_scrapes and not failed_species:
         print("No species data was found or scraped for this query.")
-        return None, None
+        yield {'type': 'done', 'analysis': None, 'raw_data': None, 'error': None}
+        return
 
-    # --- MODIFIED FUNCTION CALL ---
-    analysis_result = bd.analyze_with_gemini(combined_descriptions, user_input, failed_species_list_str)
-    return analysis_result, combined_descriptions
+    all_descriptions = _combine_descriptions(successful_scrapes)
+    # Rank descriptions locally so only the most relevant ones go into the prompt in full.
+    if config.RANKING_ENABLED and successful_scrapes:
+        prompt_species, lower_ranked = ranking.select_descriptions(
+            successful_scrapes, user_input, config.RANKING_TOP_K, config.PROMPT_TOKEN_BUDGET
+        )
+        # Map-reduce costs a Gemini call per chunk, so 'auto' only uses it when the budget
+        # would cut species the ranking placed in the top RANKING_TOP_K.
+        over_budget = len(prompt_species) < min(config.RANKING_TOP_K, len(successful_scrapes))
+    else:
+        prompt_species, lower_ranked = successful_scrapes, []
+        over_budget = ranking.estimate_tokens(all_descriptions) > config.PROMPT_TOKEN_BUDGET
+    use_map_reduce = successful_scrapes and (
+        config.GEMINI_ANALYSIS_MODE == 'map_reduce'
+        or (config.GEMINI_ANALYSIS_MODE == 'auto' and over_budget)
+    )
+    ranking_table, status = "", {}
+    if use_map_reduce:
+        # Every description is screened, so the local pre-ranking is not used.
+        chunks = bd.stream_gemini_map_reduce(successful_scrapes, user_input, failed_species_list_str,
+                                             status=status)
+    else:
+        if config.RANKING_ENABLED and successful_scrapes:
+            print(f"--> Sending {len(prompt_species)} of {len(successful_scrapes)} descriptions to Gemini in full.")
+            ranking_table = ranking.format_ranking_table(prompt_species, lower_ranked)
+        prompt_descriptions = _combine_descriptions(prompt_species)
+        lower_ranked_list_str = "\n".join([f"- {s['name']}" for s in lower_ranked])
+        chunks = bd.stream_gemini_analysis(prompt_descriptions, user_input, failed_species_list_str, lower_ranked_list_str,
+                                           status=status)
 
-def generate_html_report(analysis_content, verbatim_data):
-    # ... (this function remains exactly the same) ...
-    html_body = markdown.markdown(analysis_content, extensions=['tables'])
-    appendix_html = ""
-    if verbatim_data:
-        appendix_html = f"""
-        <hr><h2>Verbatim Scraped Data for Manual Analysis</h2>
-        <details><summary>Click to expand/collapse raw data</summary>
-        <pre style="white-space: pre-wrap; word-wrap: break-word; background-color: #f6f8fa; padding: 15px; border-radius: 5px; border: 1px solid #ddd;"><code>{verbatim_data}</code></pre>
+    analysis_parts = []
+    for text in chunks:
+        analysis_parts.append(text)
+        yield {'type': 'analysis_chunk', 'text': text}
+    if ranking_table:
+        text = f"\n\n{ranking_table}"
+        analysis_parts.append(text)
+        yield {'type': 'analysis_chunk', 'text': text}
+    # The report appendix keeps every scraped description, including the lower-ranked ones.
+    yield {'type': 'done', 'analysis': "".join(analysis_parts), 'raw_data': all_descriptions,
+           'error': status.get('error')}
+
+def analyze_species_data(species_data, user_input):
+    """Blocking form of iter_analysis; returns (analysis, raw_data)."""
+    for event in iter_analysis(species_data, user_input):
+        if event['type'] == 'done':
+            return event['analysis'], event['raw_data']
+    return None, None
+
+def iter_identification_process(latitude, longitude, radius_km, taxon_name, user_input):
+    """The main workflow, as a generator of progress events.
+
+    Yields dicts with a 'type' key:
+      'checklist'      - 'checklist': the GBIF species list, before any scraping starts
+      'species'        - 'index', 'result': one species' description result, as soon as it finishes
+      'analysis_chunk' - 'text': the next piece of the analysis as Gemini streams it
+      'done'           - 'analysis', 'raw_data': the final results (both None if nothing was found),
+                         'error': set if the Gemini analysis failed (see iter_analysis),
+                         'profile': the run profile (see instrumentation.py)
+    """
+    started = time.monotonic()
+    profile = instrumentation.Profile('identification')
+    # 1. Get species checklist from GBIF, ranked by number of records.
+    with profile.active():
+        checklist = bd.get_species_checklist_from_gbif(latitude, longitude, radius_km, taxon_name)
+
+    if not checklist:
+        print("\nNo species found in the specified area. Halting process.")
+        yield {'type': 'done', 'analysis': None, 'raw_data': None, 'error': None, 'profile': profile.finish().to_dict()}
+        return
+
+    print("\nProceeding to scrape descriptions for the following species:")
+    for entry in checklist:
+        print(f"- {entry['name']} ({entry['count']} GBIF records)")
+    yield {'type': 'checklist', 'checklist': checklist}
+    scientific_names = [entry['name'] for entry in checklist]
+
+    # 2. Scrape each species concurrently. Per-host rate limiting happens inside
+    # botanical_data; results are reported as they finish but kept in checklist order.
+    # Species still pending when the run's time budget is spent are reported as not
+    # retrieved in time; their requests are abandoned rather than waited for.
+    species_data = [None] * len(scientific_names)
+    with profile.active():
+        fetch = instrumentation.bind(fetch_species_description)
+    deadline = started + config.RUN_TIME_BUDGET_SECONDS if config.RUN_TIME_BUDGET_SECONDS else None
+    executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS)
+    try:
+        futures = {executor.submit(fetch, entry['name'], entry): i for i, entry in enumerate(checklist)}
+        pending = set(futures)
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                break
+            for future in finished:
+                index = futures[future]
+                species_data[index] = future.result()
+                yield {'type': 'species', 'index': index, 'result': species_data[index]}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if pending:
+        print(f"\n--> Time budget of {config.RUN_TIME_BUDGET_SECONDS}s spent; {len(pending)} species were not retrieved in time.")
+        for future in sorted(pending, key=futures.get):
+            index = futures[future]
+            with profile.active():
+                instrumentation.count('species_timed_out')
+            species_data[index] = {'name': scientific_names[index], 'success': False, 'timed_out': True,
+                                   'reason': "Not retrieved in time."}
+            yield {'type': 'species', 'index': index, 'result': species_data[index]}
+
+    # 3. Analyse the descriptions.
+    for event in profile.iterate(iter_analysis(species_data, user_input)):
+        if event['type'] == 'done':
+            event['profile'] = profile.finish().to_dict()
+        yield event
+
+# --- MODIFIED FUNCTION SIGNATURE ---
+def run_identification_process(latitude, longitude, radius_km, taxon_name, user_input):
+    """The main workflow for the botanical identification tool; returns (analysis, raw_data)."""
+    for event in iter_identification_process(latitude, longitude, radius_km, taxon_name, user_input):
+        if event['type'] == 'done':
+            return event['analysis'], event['raw_data']
+    return None, None
+
+def _combine_descriptions(species_entries):
+    return "\n\n".join([f"--- Data for {s['name']} ---\n{s['description']}" for s in species_entries])
+
+def _profile_html(profile):
+    rows = "".join(
+        f"<tr><td>{html.escape(name)}</td><td>{stage['count']}</td><td>{stage['total_seconds']:.2f}</td>"
+        f"<td>{stage['max_seconds']:.2f}</td><td>{stage['bytes'] / 1024:.0f}</td><td>{stage['retries']}</td></tr>"
+        for name, stage in sorted(profile['summary'].items(), key=lambda item: -item[1]['total_seconds'])
+    )
+    return f"""
+        <hr><h2>Run Profile</h2>
+        <p>Wall time {profile['wall_seconds']:.1f} s. Step times overlap because species are fetched concurrently.</p>
+        <table><tr><th>Step</th><th>Calls</th><th>Total s</th><th>Max s</th><th>KiB</th><th>Retries</th></tr>{rows}</table>
+        <details><summary>Click to expand/collapse the JSON run profile</summary>
+        <pre style="white-space: pre-wrap; word-wrap: break-word; background-color: #f6f8fa; padding: 15px; border-radius: 5px; border: 1px solid #ddd;"><code id="run-profile">{html.escape(json.dumps(profile, indent=1))}</code></pre>
         </details>"""
-    html_template = f"""
+
+_REPORT_HEAD = """
     <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>Taxonomic Analysis Report</title>
     <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 20px auto; padding: 25px; border: 1px solid #e1e1e1; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); }}
-        table {{ border-collapse: collapse; width: 100%; margin-top: 1em; margin-bottom: 1em; }}
-        th, td {{ text-align: left; padding: 12px; border: 1px solid #ddd; vertical-align: top; }}
-        th {{ background-color: #f7f7f7; font-weight: 600; }}
-        h1, h2, h3 {{ color: #2d3748; border-bottom: 1px solid #e2e8f0; padding-bottom: 0.3em; }}
-        details {{ margin-top: 1.5em; border: 1px solid #ddd; border-radius: 5px; padding: 10px; }}
-        summary {{ font-weight: bold; cursor: pointer; }}
-    </style></head><body><h1>Taxonomic Analysis Report</h1>{html_body}{appendix_html}</body></html>"""
-    filename = "taxonomic_analysis.html"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html_template)
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 20px auto; padding: 25px; border: 1px solid #e1e1e1; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); }
+        table { border-collapse: collapse; width: 100%; margin-top: 1em; margin-bottom: 1em; }
+        th, td { text-align: left; padding: 12px; border: 1px solid #ddd; vertical-align: top; }
+        th { background-color: #f7f7f7; font-weight: 600; }
+        h1, h2, h3 { color: #2d3748; border-bottom: 1px solid #e2e8f0; padding-bottom: 0.3em; }
+        details { margin-top: 1.5em; border: 1px solid #ddd; border-radius: 5px; padding: 10px; }
+        summary { font-weight: bold; cursor: pointer; }
+    </style></head><body><h1>Taxonomic Analysis Report</h1>"""
+_VERBATIM_HEAD = """
+        <hr><h2>Verbatim Scraped Data for Manual Analysis</h2>
+        <details><summary>Click to expand/collapse raw data</summary>
+        <pre style="white-space: pre-wrap; word-wrap: break-word; background-color: #f6f8fa; padding: 15px; border-radius: 5px; border: 1px solid #ddd;"><code>"""
+_VERBATIM_TAIL = """</code></pre>
+        </details>"""
+_REPORT_TAIL = "</body></html>"
+# The verbatim appendix is escaped and written in slices of this many characters.
+_WRITE_CHUNK_CHARS = 1 << 20
+
+def write_html_report(out, analysis_content, verbatim_data, profile=None):
+    """Writes the HTML report, UTF-8 encoded, piece by piece to the binary stream `out`."""
+    def write(text):
+        out.write(text.encode('utf-8'))
+
+    write(_REPORT_HEAD)
+    write(markdown.markdown(analysis_content, extensions=['tables']))
+    if verbatim_data:
+        write(_VERBATIM_HEAD)
+        for start in range(0, len(verbatim_data), _WRITE_CHUNK_CHARS):
+            write(html.escape(verbatim_data[start:start + _WRITE_CHUNK_CHARS], quote=False))
+        write(_VERBATIM_TAIL)
+    if profile:
+        write(_profile_html(profile))
+    write(_REPORT_TAIL)
+
+def render_html_report(analysis_content, verbatim_data, profile=None, compress=False):
+    """Returns the HTML report as bytes, gzip-compressed if `compress` is set; nothing touches the disk."""
+    buffer = io.BytesIO()
+    if compress:
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as out:
+            write_html_report(out, analysis_content, verbatim_data, profile)
+    else:
+        write_html_report(buffer, analysis_content, verbatim_data, profile)
+    return buffer.getvalue()
+
+def generate_html_report(analysis_content, verbatim_data, filename="taxonomic_analysis.html", profile=None):
+    """Writes the HTML report to `filename` (gzip-compressed if it ends in .gz) and returns the filename."""
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, "wb") as f:
+        write_html_report(f, analysis_content, verbatim_data, profile)
     return filename
 
 if __name__ == "__main__":
     # --- 1. Configure API Key ---
+    import google.generativeai as genai
     try:
         api_key = os.environ.get('GOOGLE_API_KEY')
         if not api_key:
@@ -119,19 +389,22 @@ if __name__ == "__main__":
     user_input_cli = input("Enter morphological description and locality details: ")
 
     # --- 3. Run the main process (MODIFIED) ---
-    analysis, raw_data = run_identification_process(
+    analysis, raw_data, profile = None, None, None
+    for event in iter_identification_process(
         latitude=config.DEFAULT_LATITUDE,
         longitude=config.DEFAULT_LONGITUDE,
         radius_km=config.DEFAULT_RADIUS_KM,
         taxon_name=config.DEFAULT_TAXON_NAME,
         user_input=user_input_cli
-    )
+    ):
+        if event['type'] == 'done':
+            analysis, raw_data, profile = event['analysis'], event['raw_data'], event['profile']
 
     # --- 4. Generate and save the report ---
     if analysis:
         print(f"\n\n{'='*60}\nGEMINI TAXONOMIC ANALYSIS\n{'='*60}")
         print(analysis)
-        report_filename = generate_html_report(analysis, raw_data)
+        report_filename = generate_html_report(analysis, raw_data, profile=profile)
         print("\n" + "="*60)
         print(f"✅ Analysis complete. Report saved as '{report_filename}'.")
     else:
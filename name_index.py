@@ -0,0 +1,384 @@
+# name_index.py
+
+"""A local name-resolution index mapping species names and their synonyms to IDs.
+
+Every accepted species gets one row with its GBIF backbone key, SANBI (e-Flora SA)
+species ID and POWO fqId, as far as the sources provide them. Accepted names and
+synonyms, normalised like the cache keys (lower-cased binomials), are kept in one
+sorted, memory-mapped array, so a whole checklist resolves with a single
+`np.searchsorted`. Checklist entries that are synonyms of one another are merged under
+the accepted name, and known IDs let species skip the SANBI and POWO search requests.
+
+The index is built from any mix of:
+  --gbif   the GBIF backbone's Taxon.tsv (or backbone.zip)
+  --wcvp   the WCVP names file behind POWO (wcvp_names.csv or wcvp.zip)
+  --sanbi  a SANBI species CSV with 'speciesid', 'name' and optional 'synonyms' columns
+  --from-cache  the SANBI, POWO and GBIF lookups already in the disk cache
+Building again merges into the existing index. Name exports are large, so restrict
+them to the families you work on with --family.
+
+Usage:
+    python name_index.py build --wcvp wcvp.zip --gbif backbone.zip --family Thymelaeaceae
+    python name_index.py build --from-cache
+    python name_index.py lookup "Gnidia squarrosa" "Lasiosiphon anthylloides"
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from cache import get_cache, normalise_name
+from config import NAME_INDEX_DIR, USE_NAME_INDEX
+
+ARRAYS = ['name_keys', 'name_taxa', 'taxon_names', 'gbif_keys', 'sanbi_ids', 'powo_ids']
+IPNI_PREFIX = "urn:lsid:ipni.org:names:"
+SANBI_DETAIL_PATTERN = re.compile(r'/search/detail/(\d+)')
+
+def _binomial(name):
+    """The first two words of a name, or None for anything that is not a plain binomial."""
+    words = re.sub(r'<[^>]+>', '', name or '').split()
+    if len(words) < 2 or '×' in words[:2] or not words[0][:1].isupper():
+        return None
+    return f"{words[0]} {words[1]}"
+
+def _encode(name):
+    return normalise_name(name).encode('utf-8')
+
+class NameIndex:
+    """Read-only view over an index directory; the name keys are memory-mapped."""
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.arrays = {
+            name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+            for name in ARRAYS
+        }
+
+    def __len__(self):
+        return len(self.arrays['taxon_names'])
+
+    def resolve(self, names):
+        """Looks up many names at once; returns one entry per name, or None where it is unknown.
+
+        An entry is a dict with the accepted 'name', 'gbif_key', 'sanbi_id', 'powo_id' (None
+        where unknown) and 'synonym', True when the looked-up name is not the accepted one.
+        """
+        names = list(names)
+        keys = self.arrays['name_keys']
+        if not names or len(keys) == 0:
+            return [None] * len(names)
+        width = keys.dtype.itemsize
+        # A name longer than the widest key cannot be in the index, and casting would truncate it.
+        queries = np.array([key if len(key) <= width else b'' for key in map(_encode, names)], dtype=keys.dtype)
+        positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+        found = (keys[positions] == queries) & (queries != b'')
+        rows = self.arrays['name_taxa'][positions]
+
+        results = []
+        for query, is_found, row in zip(queries, found, rows):
+            if not is_found:
+                results.append(None)
+                continue
+            accepted = self.arrays['taxon_names'][row].decode('utf-8')
+            gbif_key, sanbi_id = int(self.arrays['gbif_keys'][row]), int(self.arrays['sanbi_ids'][row])
+            powo_id = self.arrays['powo_ids'][row].decode('utf-8')
+            results.append({
+                'name': accepted,
+                'gbif_key': gbif_key if gbif_key >= 0 else None,
+                'sanbi_id': sanbi_id if sanbi_id >= 0 else None,
+                'powo_id': powo_id or None,
+                'synonym': query != _encode(accepted),
+            })
+        return results
+
+    def lookup(self, name):
+        return self.resolve([name])[0]
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+def load_index(index_dir=NAME_INDEX_DIR):
+    """Returns the index in `index_dir`, reloading it after a rebuild, or None if none exists."""
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    mtime = os.path.getmtime(meta_path)
+    with _loaded_lock:
+        cached = _loaded.get(index_dir)
+        if cached is None or cached[0] != mtime:
+            cached = _loaded[index_dir] = (mtime, NameIndex(index_dir))
+        return cached[1]
+
+def resolve_names(names):
+    """NameIndex.resolve on the configured index; all None when it is disabled or not built."""
+    index = load_index() if USE_NAME_INDEX else None
+    if index is None:
+        return [None] * len(names)
+    return index.resolve(names)
+
+# --- Building ---
+
+class _Builder:
+    """Accumulates accepted species and synonyms from the sources before they are written."""
+    def __init__(self):
+        self.taxa = {}
+        self.synonyms = {}
+
+    def add_taxon(self, name, **ids):
+        """Adds an accepted species, or fills in IDs of a known one; later sources win."""
+        binomial = _binomial(name)
+        if binomial is None:
+            return
+        key = normalise_name(binomial)
+        self.synonyms.pop(key, None)
+        taxon = self.taxa.setdefault(key, {'name': binomial, 'gbif_key': None, 'sanbi_id': None, 'powo_id': None})
+        taxon.update((field, value) for field, value in ids.items() if value is not None)
+
+    def add_synonym(self, name, accepted_name):
+        """Maps `name` to an accepted species, unless some source lists it as accepted itself."""
+        binomial, accepted = _binomial(name), _binomial(accepted_name)
+        if binomial is None or accepted is None:
+            return
+        key, accepted_key = normalise_name(binomial), normalise_name(accepted)
+        if key != accepted_key and key not in self.taxa:
+            self.synonyms[key] = accepted_key
+
+    def add_ids(self, name, **ids):
+        """Adds IDs found by searching for `name`, which may be a known synonym.
+
+        Search results are less certain than the name exports, so they only fill in missing IDs.
+        """
+        binomial = _binomial(name)
+        if binomial is None:
+            return
+        key = normalise_name(binomial)
+        taxon = self.taxa.get(self.synonyms.get(key, key))
+        if taxon is None:
+            self.add_taxon(binomial, **ids)
+            return
+        taxon.update((field, value) for field, value in ids.items() if value is not None and taxon[field] is None)
+
+    def load(self, index):
+        """Starts from the contents of an existing index."""
+        taxon_names = [name.decode('utf-8') for name in index.arrays['taxon_names']]
+        for row, name in enumerate(taxon_names):
+            powo_id = index.arrays['powo_ids'][row].decode('utf-8')
+            self.taxa[normalise_name(name)] = {
+                'name': name,
+                'gbif_key': int(index.arrays['gbif_keys'][row]) if index.arrays['gbif_keys'][row] >= 0 else None,
+                'sanbi_id': int(index.arrays['sanbi_ids'][row]) if index.arrays['sanbi_ids'][row] >= 0 else None,
+                'powo_id': powo_id or None,
+            }
+        for key, row in zip(index.arrays['name_keys'], index.arrays['name_taxa']):
+            key, accepted_key = key.decode('utf-8'), normalise_name(taxon_names[row])
+            if key != accepted_key:
+                self.synonyms[key] = accepted_key
+
+    def arrays(self):
+        taxon_keys = sorted(self.taxa)
+        rows = {key: row for row, key in enumerate(taxon_keys)}
+        names = {key: rows[key] for key in taxon_keys}
+        # Synonyms of species no source lists as accepted have nothing to point at.
+        names.update((key, rows[accepted]) for key, accepted in self.synonyms.items() if accepted in rows)
+        name_keys = sorted(names)
+        taxa = [self.taxa[key] for key in taxon_keys]
+        return {
+            'name_keys': np.array([key.encode('utf-8') for key in name_keys], dtype=bytes),
+            'name_taxa': np.array([names[key] for key in name_keys], dtype=np.int32),
+            'taxon_names': np.array([taxon['name'].encode('utf-8') for taxon in taxa], dtype=bytes),
+            'gbif_keys': np.array([-1 if taxon['gbif_key'] is None else taxon['gbif_key'] for taxon in taxa],
+                                  dtype=np.int64),
+            'sanbi_ids': np.array([-1 if taxon['sanbi_id'] is None else taxon['sanbi_id'] for taxon in taxa],
+                                  dtype=np.int64),
+            'powo_ids': np.array([(taxon['powo_id'] or '').encode('utf-8') for taxon in taxa], dtype=bytes),
+        }
+
+def _open_names(path, member_name):
+    """Opens a name export, or the file called `member_name` inside a zip, as a text stream."""
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        member = next((n for n in archive.namelist() if os.path.basename(n) == member_name), None)
+        if member is None:
+            member = next(n for n in archive.namelist() if n.endswith(('.csv', '.txt', '.tsv')))
+        return io.TextIOWrapper(archive.open(member), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+def _in_families(row, families):
+    return not families or row.get('family', '').lower() in families
+
+def _read_gbif_backbone(builder, path, families):
+    """Adds accepted species and species synonyms from the GBIF backbone's Taxon.tsv."""
+    accepted, synonyms = {}, []
+    with _open_names(path, 'Taxon.tsv') as stream:
+        for row in csv.DictReader(stream, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if row.get('kingdom') != 'Plantae' or row.get('taxonRank') != 'species' or not _in_families(row, families):
+                continue
+            status = row.get('taxonomicStatus', '')
+            if status == 'accepted':
+                accepted[row['taxonID']] = row['canonicalName']
+                builder.add_taxon(row['canonicalName'], gbif_key=int(row['taxonID']))
+            elif 'synonym' in status.lower():
+                synonyms.append((row['canonicalName'], row['acceptedNameUsageID']))
+    for name, accepted_id in synonyms:
+        if accepted_id in accepted:
+            builder.add_synonym(name, accepted[accepted_id])
+    return len(accepted), len(synonyms)
+
+def _read_wcvp(builder, path, families):
+    """Adds accepted species (with their POWO fqIds) and species synonyms from the WCVP names file."""
+    accepted, synonyms = {}, []
+    with _open_names(path, 'wcvp_names.csv') as stream:
+        for row in csv.DictReader(stream, delimiter='|', quoting=csv.QUOTE_NONE):
+            if row.get('taxon_rank') != 'Species' or not _in_families(row, families):
+                continue
+            if row.get('taxon_status') == 'Accepted':
+                accepted[row['plant_name_id']] = row['taxon_name']
+                ipni_id = row.get('powo_id') or row.get('ipni_id')
+                builder.add_taxon(row['taxon_name'], powo_id=f"{IPNI_PREFIX}{ipni_id}" if ipni_id else None)
+            elif row.get('accepted_plant_name_id'):
+                synonyms.append((row['taxon_name'], row['accepted_plant_name_id']))
+    for name, accepted_id in synonyms:
+        if accepted_id in accepted:
+            builder.add_synonym(name, accepted[accepted_id])
+    return len(accepted), len(synonyms)
+
+def _read_sanbi(builder, path):
+    """Adds species and synonyms from a SANBI CSV with 'speciesid', 'name' and 'synonyms' columns."""
+    species, synonyms = 0, 0
+    with _open_names(path, 'species.csv') as stream:
+        for row in csv.DictReader(stream):
+            row = {column.strip().lower(): value for column, value in row.items() if column}
+            name = row.get('name') or row.get('italicspeciesname') or row.get('scientificname')
+            species_id = (row.get('speciesid') or '').strip()
+            if not name or not species_id.isdigit():
+                continue
+            builder.add_taxon(name, sanbi_id=int(species_id))
+            species += 1
+            for synonym in re.split(r'[;,|]', row.get('synonyms') or ''):
+                if synonym.strip():
+                    builder.add_synonym(synonym, name)
+                    synonyms += 1
+    return species, synonyms
+
+def _read_cache(builder):
+    """Adds the IDs found by earlier SANBI, POWO and GBIF lookups in the disk cache."""
+    cache, found = get_cache(), 0
+    for key, entry in cache.items('eflora-url:'):
+        match = SANBI_DETAIL_PATTERN.search(entry['value'] or '')
+        if match:
+            builder.add_ids(key.split(':', 1)[1].capitalize(), sanbi_id=int(match.group(1)))
+            found += 1
+    for key, entry in cache.items('powo-id:'):
+        if entry['value']:
+            builder.add_ids(key.split(':', 1)[1].capitalize(), powo_id=entry['value'])
+            found += 1
+    for key, entry in cache.items('gbif-species-name:'):
+        if entry['value']:
+            builder.add_ids(entry['value'], gbif_key=int(key.split(':', 1)[1]))
+            found += 1
+    return found
+
+def build(gbif=None, wcvp=None, sanbi=None, from_cache=False, families=(), index_dir=NAME_INDEX_DIR):
+    """Merges the given sources into the index and returns it."""
+    os.makedirs(index_dir, exist_ok=True)
+    families = {family.lower() for family in families}
+    builder = _Builder()
+    existing = load_index(index_dir)
+    sources = []
+    if existing is not None:
+        builder.load(existing)
+        sources = list(existing.meta.get('sources', []))
+        # Release the memory maps before their files are replaced.
+        with _loaded_lock:
+            _loaded.pop(index_dir, None)
+        del existing
+
+    # Some exports carry very long remarks fields.
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    # A name any source lists as accepted stays a species of its own, whatever the others say.
+    for label, path, reader in (('WCVP', wcvp, lambda: _read_wcvp(builder, wcvp, families)),
+                                ('SANBI', sanbi, lambda: _read_sanbi(builder, sanbi)),
+                                ('GBIF backbone', gbif, lambda: _read_gbif_backbone(builder, gbif, families))):
+        if path:
+            print(f"--> Reading {label} names from {path}...")
+            accepted, synonyms = reader()
+            print(f"--> Read {accepted} species and {synonyms} synonyms.")
+            sources.append({'source': label, 'path': os.path.abspath(path), 'built_at': time.time()})
+    if from_cache:
+        print(f"--> Read {_read_cache(builder)} identifiers from earlier lookups in the cache.")
+        sources.append({'source': 'cache', 'built_at': time.time()})
+
+    arrays = builder.arrays()
+    meta = {
+        'taxon_count': int(len(arrays['taxon_names'])),
+        'name_count': int(len(arrays['name_keys'])),
+        'sources': sources,
+        'updated_at': time.time(),
+    }
+    # Write everything to temporary files first and swap them in, so readers never see a half-written index.
+    staged = [(_stage_array(index_dir, name, arrays[name]), f'{name}.npy') for name in ARRAYS]
+    for tmp_path, final_name in staged:
+        os.replace(tmp_path, os.path.join(index_dir, final_name))
+    # meta.json is written last; its mtime tells load_index to reload.
+    os.replace(_stage_json(index_dir, 'meta', meta), os.path.join(index_dir, 'meta.json'))
+    print(f"--> Index now maps {meta['name_count']} names to {meta['taxon_count']} accepted species.")
+    return load_index(index_dir)
+
+def _stage_array(index_dir, name, values):
+    tmp_path = os.path.join(index_dir, f'.{name}.tmp.npy')
+    np.save(tmp_path, values)
+    return tmp_path
+
+def _stage_json(index_dir, name, payload):
+    tmp_path = os.path.join(index_dir, f'.{name}.tmp.json')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    return tmp_path
+
+def _main():
+    parser = argparse.ArgumentParser(description="Build or query the local name-resolution index.")
+    parser.add_argument('--index-dir', default=NAME_INDEX_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="Merge name exports and/or cached lookups into the index.")
+    build_parser.add_argument('--gbif', help="GBIF backbone Taxon.tsv or backbone.zip.")
+    build_parser.add_argument('--wcvp', help="WCVP wcvp_names.csv or wcvp.zip.")
+    build_parser.add_argument('--sanbi', help="SANBI species CSV.")
+    build_parser.add_argument('--from-cache', action='store_true', help="Harvest earlier lookups from the disk cache.")
+    build_parser.add_argument('--family', action='append', default=[],
+                              help="Only read species of this family from GBIF and WCVP (repeatable).")
+    lookup_parser = commands.add_parser('lookup', help="Resolve names to their accepted species and IDs.")
+    lookup_parser.add_argument('names', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not (args.gbif or args.wcvp or args.sanbi or args.from_cache):
+            parser.error("give at least one of --gbif, --wcvp, --sanbi or --from-cache")
+        build(args.gbif, args.wcvp, args.sanbi, args.from_cache, args.family, args.index_dir)
+        return
+    index = load_index(args.index_dir)
+    if index is None:
+        print(f"No name index found in '{args.index_dir}'. Run the build command first.")
+        return
+    started = time.perf_counter()
+    results = index.resolve(args.names)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for name, entry in zip(args.names, results):
+        if entry is None:
+            print(f"{name}: not in the index")
+            continue
+        label = f"synonym of {entry['name']}" if entry['synonym'] else entry['name']
+        print(f"{name}: {label} (GBIF {entry['gbif_key']}, SANBI {entry['sanbi_id']}, POWO {entry['powo_id']})")
+    print(f"Resolved {len(args.names)} names in {elapsed_ms:.2f} ms.")
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,402 @@
+# occurrence_index.py
+
+"""A local, memory-mapped occurrence index built from GBIF downloads.
+
+Records are stored column by column as .npy files, sorted by a fixed lat/lon grid
+cell so that a radius query only touches the cells around the point. Ingesting a
+new export merges it into the existing index, replacing records with the same gbifID.
+
+Each ingested export also records what it covers, since downloads are usually filtered
+to a region and a taxon: the grid cells it has records in (or the --area it was
+filtered to) and the taxon all of its records share (or the --taxon it was filtered
+to). A query is only answered when one export covers both its circle and its taxon;
+anything else goes to GBIF.
+
+Usage:
+    python occurrence_index.py ingest 0012345-250101000000000.zip
+    python occurrence_index.py ingest wc_thymelaeaceae.zip --taxon Thymelaeaceae --area -34.9 -30.4 17.7 24.3
+    python occurrence_index.py query --lat -34.46 --lon 20.40 --radius 4 --taxon Thymelaeaceae
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from config import OCCURRENCE_INDEX_DIR, OCCURRENCE_INDEX_GRID_DEGREES
+
+EARTH_RADIUS_KM = 6371.0088
+RANK_COLUMNS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+SOURCE_COLUMNS = ['gbifID', 'decimalLatitude', 'decimalLongitude', 'speciesKey'] + RANK_COLUMNS
+ARRAY_COLUMNS = ['gbif_id', 'lat', 'lon', 'species_key', 'cell'] + RANK_COLUMNS
+CHUNK_ROWS = 250_000
+
+def _haversine_km(latitude, longitude, lats, lons):
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _grid_shape(grid_degrees):
+    return int(math.ceil(180 / grid_degrees)), int(math.ceil(360 / grid_degrees))
+
+def _grid_rows_cols(lats, lons, grid_degrees):
+    n_rows, n_cols = _grid_shape(grid_degrees)
+    rows = np.clip(((np.asarray(lats, dtype=np.float64) + 90) // grid_degrees).astype(np.int64), 0, n_rows - 1)
+    cols = np.clip(((np.asarray(lons, dtype=np.float64) + 180) // grid_degrees).astype(np.int64), 0, n_cols - 1)
+    return rows, cols
+
+def _cell_ids(lats, lons, grid_degrees):
+    rows, cols = _grid_rows_cols(lats, lons, grid_degrees)
+    return (rows * _grid_shape(grid_degrees)[1] + cols).astype(np.int32)
+
+def _query_box(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) of the box around a query circle."""
+    lat_offset = radius_km / 111.32
+    lon_offset = radius_km / (111.32 * max(abs(math.cos(math.radians(latitude))), 1e-6))
+    return latitude - lat_offset, latitude + lat_offset, longitude - lon_offset, longitude + lon_offset
+
+def _circle_cells(latitude, longitude, radius_km, grid_degrees):
+    """Ids of the grid cells that overlap a query circle."""
+    min_lat, max_lat, min_lon, max_lon = _query_box(latitude, longitude, radius_km)
+    (row_lo, row_hi), (col_lo, col_hi) = _grid_rows_cols([min_lat, max_lat], [min_lon, max_lon], grid_degrees)
+    rows, cols = np.meshgrid(np.arange(row_lo, row_hi + 1), np.arange(col_lo, col_hi + 1), indexing='ij')
+    rows, cols = rows.ravel(), cols.ravel()
+    # Distance from the centre to the nearest point of each cell.
+    nearest_lats = np.clip(latitude, rows * grid_degrees - 90, (rows + 1) * grid_degrees - 90)
+    nearest_lons = np.clip(longitude, cols * grid_degrees - 180, (cols + 1) * grid_degrees - 180)
+    inside = _haversine_km(latitude, longitude, nearest_lats, nearest_lons) <= radius_km
+    return (rows * _grid_shape(grid_degrees)[1] + cols)[inside]
+
+class OccurrenceIndex:
+    """Read-only view over an index directory; the columns are memory-mapped."""
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(index_dir, 'names.json'), encoding='utf-8') as f:
+            self.names = json.load(f)
+        self.grid_degrees = self.meta['grid_degrees']
+        self.columns = {
+            column: np.load(os.path.join(index_dir, f'{column}.npy'), mmap_mode='r')
+            for column in ARRAY_COLUMNS
+        }
+        self.cell_keys = np.load(os.path.join(index_dir, 'cell_keys.npy'))
+        self.cell_starts = np.load(os.path.join(index_dir, 'cell_starts.npy'))
+        lineage_path = os.path.join(index_dir, 'lineage.npy')
+        self.lineage = np.load(lineage_path) if os.path.exists(lineage_path) else None
+        self._codes_by_name = {}
+        for code, name in enumerate(self.names):
+            self._codes_by_name.setdefault(name.lower(), []).append(code)
+        # Indexes ingested before coverage was recorded have no 'cells'; they cover nothing.
+        self._coverage = [
+            (source, np.asarray(source['cells'], dtype=np.int64))
+            for source in self.meta.get('sources', []) if 'cells' in source
+        ]
+
+    def _within(self, codes, taxon, taxon_rank):
+        """True if the taxon with `codes` is `taxon` or ranks below it in every record."""
+        if self.lineage is None:
+            return False
+        rank = RANK_COLUMNS.index(taxon_rank)
+        rows = self.lineage[np.isin(self.lineage, codes).any(axis=1)]
+        if rows.size == 0 or np.isin(rows[:, :rank], codes).any():
+            return False
+        return bool(np.isin(rows[:, rank], self._codes_by_name.get(taxon.lower(), [])).all())
+
+    def covers(self, latitude, longitude, radius_km, taxon_name):
+        """True if one ingested export covers both the query circle and the taxon."""
+        codes = self._codes_by_name.get(taxon_name.strip().lower())
+        if not codes:
+            return False
+        min_lat, max_lat, min_lon, max_lon = _query_box(latitude, longitude, radius_km)
+        query_cells = None
+        for source, cells in self._coverage:
+            area = source.get('area')
+            if area:
+                if not (area[0] <= min_lat and max_lat <= area[1] and area[2] <= min_lon and max_lon <= area[3]):
+                    continue
+            else:
+                if query_cells is None:
+                    query_cells = _circle_cells(latitude, longitude, radius_km, self.grid_degrees)
+                if not np.isin(query_cells, cells).all():
+                    continue
+            if self._within(codes, source['taxon'], source['taxon_rank']):
+                return True
+        return False
+
+    def _candidate_rows(self, latitude, longitude, radius_km):
+        """Returns the record positions in every grid cell overlapping the query's bounding box."""
+        min_lat, max_lat, min_lon, max_lon = _query_box(latitude, longitude, radius_km)
+        (row_lo, row_hi), (col_lo, col_hi) = _grid_rows_cols([min_lat, max_lat], [min_lon, max_lon], self.grid_degrees)
+        n_cols = _grid_shape(self.grid_degrees)[1]
+        slices = []
+        # Cells are numbered row-major, so each grid row maps to one contiguous slice of records.
+        for row in range(row_lo, row_hi + 1):
+            first = np.searchsorted(self.cell_keys, row * n_cols + col_lo, side='left')
+            last = np.searchsorted(self.cell_keys, row * n_cols + col_hi, side='right')
+            if first < last:
+                slices.append(np.arange(self.cell_starts[first], self.cell_starts[last]))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def query_checklist(self, latitude, longitude, radius_km, taxon_name):
+        """Returns a checklist like botanical_data.get_species_checklist_from_gbif, or None if the
+        taxon is unknown to the index."""
+        codes = self._codes_by_name.get(taxon_name.strip().lower())
+        if not codes:
+            return None
+        rows = self._candidate_rows(latitude, longitude, radius_km)
+        if rows.size == 0:
+            return []
+        in_taxon = np.zeros(rows.size, dtype=bool)
+        for column in RANK_COLUMNS:
+            in_taxon |= np.isin(self.columns[column][rows], codes)
+        rows = rows[in_taxon]
+        distances = _haversine_km(latitude, longitude, self.columns['lat'][rows], self.columns['lon'][rows])
+        rows = rows[distances <= radius_km]
+        species_codes = self.columns['species'][rows]
+        rows = rows[species_codes >= 0]
+        species_codes, first, counts = np.unique(self.columns['species'][rows], return_index=True, return_counts=True)
+        species_keys = self.columns['species_key'][rows[first]] if rows.size else []
+        checklist = [
+            {'name': self.names[code], 'species_key': int(key), 'count': int(count)}
+            for code, key, count in zip(species_codes, species_keys, counts)
+        ]
+        checklist.sort(key=lambda entry: (-entry['count'], entry['name']))
+        return checklist
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+def load_index(index_dir=OCCURRENCE_INDEX_DIR):
+    """Returns the index in `index_dir`, reloading it after a re-ingest, or None if none exists."""
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    mtime = os.path.getmtime(meta_path)
+    with _loaded_lock:
+        cached = _loaded.get(index_dir)
+        if cached is None or cached[0] != mtime:
+            cached = _loaded[index_dir] = (mtime, OccurrenceIndex(index_dir))
+        return cached[1]
+
+def _open_export(path):
+    """Opens a GBIF DwC-A zip (its occurrence.txt) or a plain CSV/TSV export as a text stream."""
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        member = next((n for n in archive.namelist() if os.path.basename(n) == 'occurrence.txt'), None)
+        if member is None:
+            member = next(n for n in archive.namelist() if n.endswith(('.csv', '.txt')))
+        return io.TextIOWrapper(archive.open(member), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+def _read_export(path):
+    """Yields DataFrame chunks holding the columns the index needs."""
+    # pandas is only needed to ingest, so importing this module for queries stays cheap.
+    import pandas as pd
+    with _open_export(path) as stream:
+        header = stream.readline()
+    delimiter = '\t' if '\t' in header else ','
+    present = [c for c in SOURCE_COLUMNS if c in header.rstrip('\r\n').split(delimiter)]
+    missing = {'gbifID', 'decimalLatitude', 'decimalLongitude', 'species'} - set(present)
+    if missing:
+        raise ValueError(f"{path} is missing required columns: {', '.join(sorted(missing))}")
+    with _open_export(path) as stream:
+        reader = pd.read_csv(
+            stream, sep=delimiter, usecols=present, dtype=str, chunksize=CHUNK_ROWS,
+            quoting=csv.QUOTE_NONE if delimiter == '\t' else csv.QUOTE_MINIMAL,
+            on_bad_lines='skip', keep_default_na=False,
+        )
+        for chunk in reader:
+            yield chunk.reindex(columns=SOURCE_COLUMNS, fill_value='')
+
+def _encode_chunk(chunk, vocabulary):
+    """Converts a raw chunk into typed column arrays, adding new names to `vocabulary`."""
+    import pandas as pd
+    lats = pd.to_numeric(chunk['decimalLatitude'], errors='coerce')
+    lons = pd.to_numeric(chunk['decimalLongitude'], errors='coerce')
+    ids = pd.to_numeric(chunk['gbifID'], errors='coerce')
+    keep = lats.notna() & lons.notna() & ids.notna() & (chunk['species'] != '')
+    chunk = chunk[keep]
+    columns = {
+        'gbif_id': ids[keep].astype(np.int64).to_numpy(),
+        'lat': lats[keep].astype(np.float32).to_numpy(),
+        'lon': lons[keep].astype(np.float32).to_numpy(),
+        'species_key': pd.to_numeric(chunk['speciesKey'], errors='coerce').fillna(-1).astype(np.int64).to_numpy(),
+    }
+    for column in RANK_COLUMNS:
+        # Factorise first so the vocabulary is only consulted once per distinct name.
+        local_codes, uniques = pd.factorize(chunk[column])
+        mapping = np.array(
+            [-1 if not name else vocabulary.setdefault(name, len(vocabulary)) for name in uniques] + [-1],
+            dtype=np.int32,
+        )
+        columns[column] = mapping[local_codes]
+    return columns
+
+def _source_coverage(parts, vocabulary, grid_degrees, taxon=None, area=None):
+    """What one export covers: its occupied grid cells, its area and the taxon of its records.
+
+    Without an explicit `taxon`, the lowest-ranked taxon shared by every record is used.
+    """
+    cells = np.unique(np.concatenate([_cell_ids(part['lat'], part['lon'], grid_degrees) for part in parts]))
+    names = {code: name for name, code in vocabulary.items()}
+    if taxon is not None:
+        taxon, code = next(((name, code) for name, code in vocabulary.items() if name.lower() == taxon.lower()),
+                           (taxon, None))
+        taxon_rank = next((column for column in RANK_COLUMNS
+                           if code is not None and any((part[column] == code).any() for part in parts)), None)
+        if taxon_rank is None:
+            raise ValueError(f"--taxon '{taxon}' does not occur in the ingested records.")
+    else:
+        taxon_rank = None
+        for column in RANK_COLUMNS:
+            values = np.unique(np.concatenate([part[column] for part in parts]))
+            if len(values) != 1 or values[0] < 0:
+                break
+            taxon, taxon_rank = names[int(values[0])], column
+        if taxon_rank is None:
+            raise ValueError("The records share no kingdom; pass --taxon to state what the export covers.")
+    return {'taxon': taxon, 'taxon_rank': taxon_rank, 'area': list(area) if area else None,
+            'cells': [int(cell) for cell in cells]}
+
+def ingest(paths, index_dir=OCCURRENCE_INDEX_DIR, grid_degrees=None, taxon=None, area=None):
+    """Merges one or more GBIF exports into the index, replacing records that share a gbifID.
+
+    `taxon` and `area` (min_lat, max_lat, min_lon, max_lon) state what the exports were
+    filtered to; see the module docstring.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    existing = load_index(index_dir)
+    if existing is not None:
+        grid_degrees = existing.grid_degrees
+        vocabulary = {name: code for code, name in enumerate(existing.names)}
+        parts = [{column: np.array(existing.columns[column]) for column in ARRAY_COLUMNS if column != 'cell'}]
+        sources = list(existing.meta.get('sources', []))
+        # Release the memory maps before their files are replaced.
+        with _loaded_lock:
+            _loaded.pop(index_dir, None)
+        del existing
+    else:
+        grid_degrees = grid_degrees or OCCURRENCE_INDEX_GRID_DEGREES
+        vocabulary, parts, sources = {}, [], []
+
+    for path in paths:
+        print(f"--> Reading {path}...")
+        new_parts = [_encode_chunk(chunk, vocabulary) for chunk in _read_export(path)]
+        new_parts = [part for part in new_parts if len(part['gbif_id'])]
+        print(f"--> Read {sum(len(part['gbif_id']) for part in new_parts)} usable records.")
+        if not new_parts:
+            continue
+        coverage = _source_coverage(new_parts, vocabulary, grid_degrees, taxon, area)
+        print(f"--> Covers {coverage['taxon']} ({coverage['taxon_rank']}) in "
+              + (f"lat {area[0]}..{area[1]}, lon {area[2]}..{area[3]}." if area
+                 else f"{len(coverage['cells'])} occupied grid cells."))
+        parts.extend(new_parts)
+        sources.append(dict({'path': os.path.abspath(path), 'ingested_at': time.time()}, **coverage))
+
+    if not parts:
+        print("--> Nothing to ingest.")
+        return None
+    merged = {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+
+    # Keep the most recently ingested copy of each gbifID.
+    reversed_ids = merged['gbif_id'][::-1]
+    _, first_in_reversed = np.unique(reversed_ids, return_index=True)
+    keep = len(reversed_ids) - 1 - first_in_reversed
+    merged = {column: values[keep] for column, values in merged.items()}
+
+    merged['cell'] = _cell_ids(merged['lat'], merged['lon'], grid_degrees)
+    order = np.argsort(merged['cell'], kind='stable')
+    merged = {column: values[order] for column, values in merged.items()}
+    cell_keys, cell_starts = np.unique(merged['cell'], return_index=True)
+    cell_starts = np.append(cell_starts, len(merged['cell'])).astype(np.int64)
+    # Each distinct kingdom..species combination, for telling which taxa lie below which.
+    lineage = np.unique(np.stack([merged[column] for column in RANK_COLUMNS], axis=1), axis=0)
+
+    names = [None] * len(vocabulary)
+    for name, code in vocabulary.items():
+        names[code] = name
+    meta = {
+        'grid_degrees': grid_degrees,
+        'record_count': int(len(merged['gbif_id'])),
+        'bbox': [float(merged['lat'].min()), float(merged['lon'].min()),
+                 float(merged['lat'].max()), float(merged['lon'].max())] if len(merged['gbif_id']) else None,
+        'sources': sources,
+        'updated_at': time.time(),
+    }
+
+    # Write everything to temporary files first and swap them in, so readers never see a half-written index.
+    staged = []
+    for column in ARRAY_COLUMNS:
+        staged.append((_stage_array(index_dir, column, merged[column]), f'{column}.npy'))
+    staged.append((_stage_array(index_dir, 'cell_keys', cell_keys), 'cell_keys.npy'))
+    staged.append((_stage_array(index_dir, 'cell_starts', cell_starts), 'cell_starts.npy'))
+    staged.append((_stage_array(index_dir, 'lineage', lineage), 'lineage.npy'))
+    staged.append((_stage_json(index_dir, 'names', names), 'names.json'))
+    for tmp_path, final_name in staged:
+        os.replace(tmp_path, os.path.join(index_dir, final_name))
+    # meta.json is written last; its mtime tells load_index to reload.
+    os.replace(_stage_json(index_dir, 'meta', meta), os.path.join(index_dir, 'meta.json'))
+    print(f"--> Index now holds {meta['record_count']} records in {len(cell_keys)} grid cells.")
+    return load_index(index_dir)
+
+def _stage_array(index_dir, name, values):
+    tmp_path = os.path.join(index_dir, f'.{name}.tmp.npy')
+    np.save(tmp_path, values)
+    return tmp_path
+
+def _stage_json(index_dir, name, payload):
+    tmp_path = os.path.join(index_dir, f'.{name}.tmp.json')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    return tmp_path
+
+def _main():
+    parser = argparse.ArgumentParser(description="Build or query the local GBIF occurrence index.")
+    parser.add_argument('--index-dir', default=OCCURRENCE_INDEX_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="Merge GBIF DwC-A or CSV exports into the index.")
+    ingest_parser.add_argument('paths', nargs='+')
+    ingest_parser.add_argument('--grid-degrees', type=float, default=None,
+                               help="Grid cell size for a new index (ignored when updating an existing one).")
+    ingest_parser.add_argument('--taxon', help="Taxon the exports were filtered to (default: the lowest one "
+                                               "all their records share).")
+    ingest_parser.add_argument('--area', type=float, nargs=4, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON'),
+                               help="Box the exports were filtered to (default: the grid cells they have records in).")
+    query_parser = commands.add_parser('query', help="List species recorded within a radius of a point.")
+    query_parser.add_argument('--lat', type=float, required=True)
+    query_parser.add_argument('--lon', type=float, required=True)
+    query_parser.add_argument('--radius', type=float, required=True, help="Radius in km.")
+    query_parser.add_argument('--taxon', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        ingest(args.paths, args.index_dir, args.grid_degrees, args.taxon, args.area)
+        return
+    index = load_index(args.index_dir)
+    if index is None:
+        print(f"No occurrence index found in '{args.index_dir}'. Run the ingest command first.")
+        return
+    started = time.perf_counter()
+    covered = index.covers(args.lat, args.lon, args.radius, args.taxon)
+    checklist = index.query_checklist(args.lat, args.lon, args.radius, args.taxon)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not covered:
+        print("Warning: no ingested export covers this query; the app would ask GBIF instead.")
+    if checklist is None:
+        print(f"Taxon '{args.taxon}' does not occur in the index.")
+        return
+    for entry in checklist:
+        print(f"{entry['count']:>6}  {entry['name']}")
+    print(f"{len(checklist)} species in {elapsed_ms:.1f} ms.")
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,73 @@
+# prefetch.py
+
+"""Prefetches the descriptions of a regional flora into the local warehouse.
+
+Lists every species of a taxon recorded in a province or bounding box on GBIF, scrapes
+each one from e-Flora SA or POWO and stores the result in the warehouse (see
+warehouse.py). Species fetched successfully within the last WAREHOUSE_REFRESH_DAYS are
+skipped and failed fetches are retried, so an interrupted run can simply be restarted
+and a scheduled run only refreshes what is stale or missing, e.g. from cron:
+
+    0 3 * * 0  cd /path/to/repo && python prefetch.py Thymelaeaceae --province "Western Cape"
+
+Usage:
+    python prefetch.py <taxon> --province "Western Cape"
+    python prefetch.py <taxon> --bbox MIN_LAT MAX_LAT MIN_LON MAX_LON
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import botanical_data as bd
+import config
+import main
+from warehouse import get_warehouse
+
+# Bounding boxes (min_lat, max_lat, min_lon, max_lon) of the South African provinces.
+# Boxes overlap their neighbours, so a prefetch may include a few border species.
+PROVINCES = {
+    'Eastern Cape': (-34.3, -30.0, 22.7, 30.2),
+    'Free State': (-30.7, -26.6, 24.3, 29.8),
+    'Gauteng': (-26.9, -25.1, 27.1, 29.1),
+    'KwaZulu-Natal': (-31.1, -26.8, 28.8, 32.9),
+    'Limpopo': (-25.4, -22.1, 26.4, 31.9),
+    'Mpumalanga': (-27.4, -24.4, 28.2, 32.1),
+    'North West': (-28.0, -24.6, 22.6, 28.3),
+    'Northern Cape': (-32.9, -24.7, 16.4, 25.6),
+    'Western Cape': (-34.9, -30.4, 17.7, 24.3),
+}
+
+def prefetch(taxon_name, bbox, refresh_days=config.WAREHOUSE_REFRESH_DAYS, workers=config.MAX_WORKERS):
+    """Scrapes every species of `taxon_name` in `bbox` that is missing or stale; returns the number stored."""
+    store = get_warehouse(create=True)
+    checklist = bd.get_species_checklist_in_bbox(*bbox, taxon_name)
+    cutoff = time.time() - refresh_days * 24 * 3600
+    entries = [entry for entry in checklist
+               if (store.fetched_at(entry['name'], successful_only=True) or 0) < cutoff]
+    print(f"{len(checklist)} species listed; {len(checklist) - len(entries)} already fresh, {len(entries)} to fetch.")
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(main.scrape_species_description, entry['name'], ids=entry): entry for entry in entries}
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            store.put(result)
+            stored += 1
+            print(f"  [{done}/{len(entries)}] {result['name']}: {result.get('source') if result['success'] else result['reason']}")
+    return stored
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('taxon', help="Taxon to enumerate, e.g. a family or genus.")
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument('--province', choices=sorted(PROVINCES), help="South African province.")
+    area.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON'))
+    parser.add_argument('--refresh-days', type=float, default=config.WAREHOUSE_REFRESH_DAYS,
+                        help="Re-scrape species stored longer ago than this.")
+    parser.add_argument('--workers', type=int, default=config.MAX_WORKERS)
+    args = parser.parse_args()
+
+    bbox = PROVINCES[args.province] if args.province else tuple(args.bbox)
+    count = prefetch(args.taxon, bbox, args.refresh_days, args.workers)
+    print(f"\n✅ Stored {count} species in '{config.WAREHOUSE_PATH}'.")
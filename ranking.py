@@ -0,0 +1,101 @@
+# ranking.py
+
+"""Local BM25 ranking of scraped descriptions against the user's specimen notes.
+
+Only the top-ranked descriptions that fit the prompt token budget are sent to
+Gemini in full; the remaining species are listed by name.
+"""
+
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# Paragraphs whose heading line contains any of these words are treated as trait sections.
+TRAIT_MARKERS = frozenset(['morphology', 'morphological', 'habit', 'leaf', 'stem', 'branch', 'flower', 'fruit',
+                           'inflorescence', 'bract', 'perianth', 'style', 'seed', 'hypanthium', 'petal', 'sepal',
+                           'calyx', 'corolla'])
+STOPWORDS = frozenset("""a an and are as at be by for from in into is it its of on or than that the their
+    then these this to up with without very more less often usually sometimes about""".split())
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def _normalise_token(token):
+    # A light plural folding so that 'leaves'/'leaf' and 'flowers'/'flower' meet.
+    if len(token) > 4:
+        if token.endswith('ves'):
+            return token[:-3] + 'f'
+        if token.endswith('ies'):
+            return token[:-3] + 'y'
+        if token.endswith('s') and not token.endswith('ss'):
+            return token[:-1]
+    return token
+
+def tokenize(text):
+    return [_normalise_token(t) for t in re.findall(r"[a-z]+(?:-[a-z]+)*|\d+(?:\.\d+)?", text.lower())
+            if t not in STOPWORDS]
+
+def trait_text(description):
+    """Returns the trait sections of a scraped description, or all of it if none are recognised."""
+    paragraphs = [p for p in re.split(r"\n\s*\n", description) if p.strip()]
+    traits = [p for p in paragraphs if TRAIT_MARKERS.intersection(tokenize(p.split('\n', 1)[0]))]
+    return "\n\n".join(traits) if traits else description
+
+def bm25_scores(query, documents):
+    """Scores each document against the query with Okapi BM25."""
+    query_terms = sorted(set(tokenize(query)))
+    if not documents or not query_terms:
+        return np.zeros(len(documents))
+    term_index = {term: i for i, term in enumerate(query_terms)}
+    term_freqs = np.zeros((len(documents), len(query_terms)))
+    lengths = np.zeros(len(documents))
+    for row, document in enumerate(documents):
+        tokens = tokenize(document)
+        lengths[row] = len(tokens)
+        for term, count in Counter(tokens).items():
+            column = term_index.get(term)
+            if column is not None:
+                term_freqs[row, column] = count
+    doc_freqs = np.count_nonzero(term_freqs, axis=0)
+    idf = np.log1p((len(documents) - doc_freqs + 0.5) / (doc_freqs + 0.5))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    weighted = term_freqs * (BM25_K1 + 1) / (term_freqs + length_norm[:, None])
+    return weighted @ idf
+
+def estimate_tokens(text):
+    """Rough token count used for budgeting (about four characters per token)."""
+    return math.ceil(len(text) / 4)
+
+def select_descriptions(species_data, user_input, top_k, token_budget):
+    """Ranks successful scrapes and splits them into (selected, overflow).
+
+    Each returned entry is a copy of the species dict with 'score' and 'rank' added.
+    `selected` holds at most `top_k` of the best-scoring descriptions whose combined
+    size fits `token_budget`; the best one is always kept.
+    """
+    scores = bm25_scores(user_input or "", [trait_text(s['description']) for s in species_data])
+    order = sorted(range(len(species_data)), key=lambda i: (-scores[i], species_data[i]['name']))
+    selected, overflow, used_tokens = [], [], 0
+    for rank, i in enumerate(order, start=1):
+        entry = dict(species_data[i], score=float(scores[i]), rank=rank)
+        tokens = estimate_tokens(entry['description'])
+        if not selected or (len(selected) < top_k and used_tokens + tokens <= token_budget):
+            selected.append(entry)
+            used_tokens += tokens
+        else:
+            overflow.append(entry)
+    return selected, overflow
+
+def format_ranking_table(selected, overflow):
+    """Markdown table of ranking scores for the report."""
+    rows = ["### **Local Relevance Ranking**",
+            "Descriptions were pre-ranked locally (BM25) against the specimen details; "
+            "only the included ones were sent to the model in full.",
+            "",
+            "| Rank | Species | Score | Sent in full |",
+            "|---|---|---|---|"]
+    included = {entry['rank'] for entry in selected}
+    for entry in sorted(selected + overflow, key=lambda e: e['rank']):
+        rows.append(f"| {entry['rank']} | {entry['name']} | {entry['score']:.2f} | {'Yes' if entry['rank'] in included else 'No'} |")
+    return "\n".join(rows)
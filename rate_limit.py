@@ -0,0 +1,65 @@
+# rate_limit.py
+
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import HOST_RATE_LIMITS, DEFAULT_RATE_LIMIT
+
+class TokenBucket:
+    """A thread-safe token bucket allowing `rate` requests per second with bursts of up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` tokens are available, then consumes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def limiter_for(url):
+    """Returns the shared token bucket for the host of `url`, creating it on first use."""
+    host = urlparse(url).netloc
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, capacity = HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            bucket = _buckets[host] = TokenBucket(rate, capacity)
+        return bucket
+
+_local = threading.local()
+
+@contextmanager
+def watch_requests(queued, sent):
+    """Calls `queued()` when a request made by this thread starts waiting for its rate limiter
+    and `sent()` once it has passed it."""
+    previous = getattr(_local, 'watcher', None)
+    _local.watcher = (queued, sent)
+    try:
+        yield
+    finally:
+        _local.watcher = previous
+
+def throttle(url):
+    """Waits for the per-host rate limiter before a request to `url` is sent."""
+    watcher = getattr(_local, 'watcher', None)
+    if watcher is not None:
+        watcher[0]()
+    limiter_for(url).acquire()
+    if watcher is not None:
+        watcher[1]()
@@ -0,0 +1,84 @@
+# singleflight.py
+
+"""Coalescing of concurrent identical calls.
+
+While a call for a key is in flight, further calls with the same key wait for it and
+receive its result (or its exception) instead of repeating the work. Nothing is kept
+once the call returns; remembering results is the disk cache's job. Callers of the
+same key share one result object, so it must not be mutated.
+"""
+
+import threading
+from functools import wraps
+
+import instrumentation
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Group:
+    """A set of in-flight calls with per-namespace counters."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def do(self, namespace, key, func, *args, **kwargs):
+        """Runs func(*args, **kwargs), unless a call for (namespace, key) is in flight; then shares its outcome."""
+        flight_key = (namespace, key)
+        with self._lock:
+            counters = self._stats.setdefault(namespace, {'calls': 0, 'executed': 0, 'coalesced': 0})
+            counters['calls'] += 1
+            call = self._calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._calls[flight_key] = _Call()
+                counters['executed'] += 1
+            else:
+                counters['coalesced'] += 1
+
+        if not leader:
+            instrumentation.count('singleflight_coalesced', namespace=namespace)
+            instrumentation.annotate(coalesced=True)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+
+    def stats(self):
+        """Returns a copy of the per-namespace 'calls', 'executed' and 'coalesced' counters."""
+        with self._lock:
+            return {namespace: dict(counters) for namespace, counters in self._stats.items()}
+
+_group = Group()
+
+def singleflight(namespace, key_func=None):
+    """Decorator coalescing concurrent calls whose `key_func(*args, **kwargs)` keys are equal.
+
+    Without `key_func` the key is the positional and keyword arguments themselves.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = key_func(*args, **kwargs) if key_func else (args, tuple(sorted(kwargs.items())))
+            return _group.do(namespace, key, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def stats():
+    """Counters of the process-wide group used by the decorator."""
+    return _group.stats()
@@ -0,0 +1,170 @@
+# warehouse.py
+
+"""Local warehouse of species descriptions with full-text search.
+
+prefetch.py fills it with the descriptions of a whole regional flora; at request time
+main.fetch_species_description reads from it instead of scraping. Every species has
+one row in `descriptions` (the scraped text, its source and when it was fetched, or
+the reason no description was found), and its parsed sections are indexed in an
+SQLite FTS5 table.
+
+Usage:
+    python warehouse.py search "leaves hairy bracts" [--limit 20]
+    python warehouse.py stats
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache import normalise_name
+from config import WAREHOUSE_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS descriptions (
+    name_key TEXT PRIMARY KEY, name TEXT NOT NULL, success INTEGER NOT NULL, source TEXT,
+    description TEXT, reason TEXT, fetched_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS sections USING fts5(
+    name_key UNINDEXED, name, source UNINDEXED, heading, body, tokenize = 'porter unicode61'
+);
+"""
+_HEADING_LINE = re.compile(r"^--- (.+?) ---$", re.MULTILINE)
+# POWO rows are written as "Term:\nDefinition".
+_POWO_TERM_LINE = re.compile(r"^([^\n:]{1,80}):$", re.MULTILINE)
+
+def split_sections(description):
+    """Splits a scraped description into (heading, body) pairs.
+
+    e-Flora SA sections are headed '--- Heading ---'; POWO descriptions have a
+    '--- Source ---' line followed by 'Term:' rows, and each term becomes a section.
+    """
+    sections = []
+    headings = list(_HEADING_LINE.finditer(description))
+    for i, match in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(description)
+        body = description[match.end():end].strip()
+        terms = list(_POWO_TERM_LINE.finditer(body))
+        if terms:
+            for j, term in enumerate(terms):
+                term_end = terms[j + 1].start() if j + 1 < len(terms) else len(body)
+                text = body[term.end():term_end].strip()
+                if text:
+                    sections.append((term.group(1).strip(), text))
+        elif body:
+            sections.append((match.group(1).strip(), body))
+    if not sections and description.strip():
+        sections.append(("Description", description.strip()))
+    return sections
+
+class Warehouse:
+    """SQLite store of species descriptions, safe to share between threads."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def get(self, name):
+        """Returns the stored result for a species in fetch_species_description's form, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT success, source, description, reason FROM descriptions WHERE name_key = ?",
+                (normalise_name(name),),
+            ).fetchone()
+        if row is None:
+            return None
+        success, source, description, reason = row
+        if success:
+            return {'name': name, 'success': True, 'source': source, 'description': description}
+        return {'name': name, 'success': False, 'reason': reason}
+
+    def fetched_at(self, name, successful_only=False):
+        """When the species was last stored, or None; with `successful_only`, failed fetches count as never."""
+        with self._lock:
+            row = self._conn.execute("SELECT fetched_at, success FROM descriptions WHERE name_key = ?",
+                                     (normalise_name(name),)).fetchone()
+        if row is None or (successful_only and not row[1]):
+            return None
+        return row[0]
+
+    def put(self, result, fetched_at=None):
+        """Stores one fetch_species_description result, replacing any earlier one."""
+        name_key = normalise_name(result['name'])
+        sections = split_sections(result['description']) if result['success'] else []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO descriptions (name_key, name, success, source, description, reason, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name_key, result['name'], int(result['success']), result.get('source'),
+                     result.get('description'), result.get('reason'), fetched_at or time.time()),
+                )
+                self._conn.execute("DELETE FROM sections WHERE name_key = ?", (name_key,))
+                self._conn.executemany(
+                    "INSERT INTO sections (name_key, name, source, heading, body) VALUES (?, ?, ?, ?, ?)",
+                    [(name_key, result['name'], result.get('source'), heading, body) for heading, body in sections],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def search(self, query, limit=20):
+        """Full-text search over all sections; returns dicts ranked best first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, source, heading, snippet(sections, 4, '[', ']', ' ... ', 12), bm25(sections) "
+                "FROM sections WHERE sections MATCH ? ORDER BY bm25(sections) LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        return [{'name': name, 'source': source, 'heading': heading, 'snippet': snippet, 'score': -score}
+                for name, source, heading, snippet, score in rows]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT COALESCE(source, 'none'), COUNT(*) FROM descriptions GROUP BY source"
+            ).fetchall())
+
+_warehouse = None
+_warehouse_lock = threading.Lock()
+
+def get_warehouse(create=False):
+    """Returns the process-wide warehouse, or None if it has not been built and `create` is False."""
+    global _warehouse
+    with _warehouse_lock:
+        if _warehouse is None:
+            if not create and not os.path.exists(WAREHOUSE_PATH):
+                return None
+            os.makedirs(os.path.dirname(WAREHOUSE_PATH) or ".", exist_ok=True)
+            _warehouse = Warehouse(WAREHOUSE_PATH)
+        return _warehouse
+
+def _main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    search_parser = commands.add_parser('search', help="Full-text search across stored descriptions.")
+    search_parser.add_argument('query', help="FTS5 query, e.g. 'hairy AND bracts' or '\"leaves opposite\"'.")
+    search_parser.add_argument('--limit', type=int, default=20)
+    commands.add_parser('stats', help="Count stored species by source.")
+    args = parser.parse_args()
+
+    warehouse = get_warehouse()
+    if warehouse is None:
+        print(f"No warehouse at '{WAREHOUSE_PATH}'. Build one with prefetch.py first.")
+        return
+    if args.command == 'search':
+        for hit in warehouse.search(args.query, args.limit):
+            print(f"{hit['score']:6.2f}  {hit['name']} ({hit['source']}) - {hit['heading']}\n        {hit['snippet']}")
+    else:
+        for source, count in sorted(warehouse.stats().items()):
+            print(f"{source:<12}{count:>8}")
+
+if __name__ == "__main__":
+    _main()